@@ -1,4 +1,5 @@
 import json
+import hashlib
 from collections import defaultdict
 from helper.typing import *
 
@@ -61,6 +62,18 @@ class Collective:
         self.postcondition_dict[dest].add(id)
 
 
+    def content_hash(self) -> str:
+        """
+        Hash of the chunk size, precondition, and postcondition, stable across processes.
+
+        :return: hex digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(float(self.chunk_size)).encode())
+        digest.update(repr(sorted((int(chunk), int(node)) for chunk, node in self.precondition)).encode())
+        digest.update(repr(sorted((int(chunk), int(node)) for chunk, node in self.postcondition)).encode())
+        return digest.hexdigest()
+
     def write_json(self, filename: str) -> None:
         with open(filename, mode="w", newline="") as f:
             json.dump({
@@ -0,0 +1,60 @@
+import math
+from collections import defaultdict
+from helper.typing import *
+from topology.compiled_topology import CompiledTopology
+from collective.collective import Collective
+
+def lt(a, b, rel_tol=1e-9):
+    return a<b and not math.isclose(a, b, rel_tol=rel_tol)
+
+def leq(a, b, rel_tol=1e-9):
+    return a<b or math.isclose(a, b, rel_tol=rel_tol)
+
+def find_violations(edge_chunk_list: Dict[LinkId, List[Tuple[ChunkId,Time,Time]]], compiled: CompiledTopology, collective: Collective, rel_tol=1e-6) -> List[str]:
+    """
+    Check a schedule in O(T log T) for T transmissions: the transmissions of each link are sorted by send time once,
+    and possession is looked up in the earliest arrival of every (node, chunk).
+
+    :param edge_chunk_list: transmissions (chunk, send time, receive time) of every link
+    :param compiled: compiled topology for the chunk size of the collective
+    :param collective: collective
+    :param rel_tol: relative tolerance of time comparisons
+    :return: every violation found
+    """
+    violations = []
+    # Links are right duration
+    for edge,transmissions in edge_chunk_list.items():
+        link_delay = compiled.delay[compiled.edge_index[edge]]
+        for chunk_id,send_time,rec_time in transmissions:
+            if not math.isclose(send_time + link_delay, rec_time, rel_tol=rel_tol):
+                violations.append(f"Edge {edge} chunk {chunk_id} should have rec-send={link_delay} but got {rec_time}-{send_time}={rec_time-send_time}")
+    # Links send one chunk at a time: a transmission overlaps an earlier one iff it starts before the latest end so far
+    for edge,transmissions in edge_chunk_list.items():
+        sent = set()
+        latest = None
+        for chunk_id,send_time,rec_time in sorted(transmissions, key=lambda transmission: transmission[1]):
+            if chunk_id in sent:
+                violations.append(f"Link {edge} sent chunk {chunk_id} multiple times")
+            sent.add(chunk_id)
+            if latest is not None and lt(send_time,latest[2],rel_tol):
+                violations.append(f"Link {edge} sent chunk {chunk_id} during {latest[0]}: {latest[1]}<={send_time}<{latest[2]}")
+            if latest is None or rec_time>latest[2]:
+                latest = (chunk_id, send_time, rec_time)
+    # Links send chunks only if they have it or is precondition
+    # a precondition is possessed from the start, whatever the send time
+    arrival = {(node, chunk): -math.inf for chunk, node in collective.precondition}
+    for (src, dest),transmissions in edge_chunk_list.items():
+        for chunk_id,send_time,rec_time in transmissions:
+            arrival[dest, chunk_id] = min(arrival.get((dest, chunk_id), rec_time), rec_time)
+    for (src, dest),transmissions in edge_chunk_list.items():
+        for chunk_id,send_time,rec_time in transmissions:
+            if (src, chunk_id) not in arrival or not leq(arrival[src, chunk_id],send_time,rel_tol=rel_tol):
+                violations.append(f"Link {(src, dest)} tried to send chunk {chunk_id} before possession")
+    # Postcondition is satisfied at end
+    missing = defaultdict(set)
+    for chunk, node in collective.postcondition:
+        if (node, chunk) not in arrival:
+            missing[node].add(chunk)
+    for node, chunks in missing.items():
+        violations.append(f"Postcondition error: node {node} doesn't have chunks {chunks}")
+    return violations
@@ -0,0 +1,14 @@
+import os
+
+def get_cache_dir(name: str) -> str:
+    """
+    Directory of an on-disk cache, outside the working tree: $TACOS_CACHE_DIR/<name> if set,
+    otherwise <user cache dir>/tacos/<name>, where the user cache dir is $XDG_CACHE_HOME or ~/.cache.
+
+    :param name: name of the cache
+    :return: directory of the cache (not created)
+    """
+    if os.environ.get("TACOS_CACHE_DIR"):
+        return os.path.join(os.environ["TACOS_CACHE_DIR"], name)
+    user_cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(user_cache_dir, "tacos", name)
@@ -0,0 +1,32 @@
+import time
+from typing import Optional
+
+
+class Deadline:
+    """
+    Wall clock deadline for anytime synthesis
+    """
+
+    def __init__(self,
+                 time_budget: Optional[float] = None):
+        """
+        Initializer
+
+        :param time_budget: budget in seconds from now (None for no deadline)
+        """
+        self.time_budget = time_budget
+        self.end_time = None if time_budget is None else time.perf_counter() + time_budget
+
+    def expired(self) -> bool:
+        """
+        :return: whether the budget is used up
+        """
+        return self.end_time is not None and time.perf_counter() >= self.end_time
+
+    def remaining(self) -> Optional[float]:
+        """
+        :return: remaining budget in seconds (None for no deadline)
+        """
+        if self.end_time is None:
+            return None
+        return max(self.end_time - time.perf_counter(), 0.)
@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from helper.typing import *
+from helper.cache_dir import get_cache_dir
+from topology.topology import Topology
+from collective.collective import Collective
+try:
+    import fcntl
+except ImportError:  # no advisory locks (e.g., Windows): eviction is then best effort
+    fcntl = None
+
+RESULT_CACHE_DIR = get_cache_dir("results")
+
+
+class ResultCache:
+    """
+    On-disk cache of result csvs, keyed by the content of the synthesis problem rather than the names on the command line.
+
+    Each result is stored as <key>.csv in cache_dir and written to a temporary file first, so concurrent readers never
+    see a partial file. The modification time of an entry is its last use: hits touch it, and once the entries exceed
+    max_bytes, the least recently used ones are removed under an advisory lock on cache_dir/.lock. A reader that loses
+    an entry to a concurrent eviction sees a miss.
+    """
+    def __init__(self, cache_dir: str = RESULT_CACHE_DIR, max_bytes: int = 1 << 30):
+        """
+        :param cache_dir: directory of the cache
+        :param max_bytes: largest total size of the cached results
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(topology: Topology, collective: Collective, synthesizer: str, parameters: Dict, seed: Optional[int]) -> str:
+        """
+        :param topology: topology
+        :param collective: collective (its chunk size determines the link delays)
+        :param synthesizer: name of the synthesizer
+        :param parameters: every other parameter that can change the result, JSON-serializable
+        :param seed: seed of the synthesizer
+        :return: hex digest of the links with their alpha and beta, the chunk size, the pre- and postconditions,
+                 the synthesizer, its parameters, and the seed
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(topology.compile(collective.chunk_size).content_hash().encode())
+        digest.update(collective.content_hash().encode())
+        digest.update(json.dumps({"synthesizer": synthesizer, "parameters": parameters, "seed": seed}, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str, filename: str) -> bool:
+        """
+        Copy the cached result to filename if there is one.
+
+        :param key: key of the result
+        :param filename: result csv to write
+        :return: whether the result was cached
+        """
+        entry = os.path.join(self.cache_dir, f"{key}.csv")
+        try:
+            shutil.copyfile(entry, filename)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def put(self, key: str, filename: str) -> None:
+        """
+        Cache a result and evict the least recently used results beyond max_bytes.
+
+        :param key: key of the result
+        :param filename: result csv to cache
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            with open(filename, mode="rb") as result:
+                shutil.copyfileobj(result, f)
+        os.replace(f.name, os.path.join(self.cache_dir, f"{key}.csv"))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used results until the rest fit in max_bytes.
+        """
+        with open(os.path.join(self.cache_dir, ".lock"), mode="a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".csv"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total<=self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -2,6 +2,7 @@ import os
 import sys
 import re
 import json
+import hashlib
 import random
 import signal
 import argparse
@@ -11,8 +12,10 @@ import networkx as nx
 import matplotlib.pyplot as plt
 from runner.animate import animate_collective
 from runner.verify import verify_collective
+from runner.result_cache import ResultCache, RESULT_CACHE_DIR
 from helper.git_hash import get_git_hash
 from helper.timer import Timer
+from helper.deadline import Deadline
 from topology.topology import Topology
 from topology.built_in_topologies import get_topology
 from collective.collective import Collective
@@ -27,6 +30,12 @@ from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
 from synthesizer.multiple_tacos_synthesizer import MultipleTACOSSynthesizer
 from synthesizer.beam_synthesizer import BeamSynthesizer
 from synthesizer.ilp_synthesizer import ILPSynthesizer
+from synthesizer.ten_synthesizer import TENSynthesizer
+from synthesizer.ten_ilp_synthesizer import TENILPSynthesizer
+from synthesizer.hierarchical_synthesizer import HierarchicalSynthesizer
+from synthesizer.symmetric_synthesizer import SymmetricSynthesizer
+from synthesizer.pipelined_synthesizer import PipelinedSynthesizer
+from synthesizer.retiming import RetimingSynthesizer, read_schedule
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
 def main():
@@ -37,18 +46,34 @@ def main():
     # General arguments
     parser.add_argument("--topology", action="store", type=str, required=True, help="Name of topology or filepath to topology csv")
     parser.add_argument("--collective", action="store", type=str, required=True, help="Name of collective pattern or filepath to collective csv")
+    parser.add_argument("--collectives_count", action="store", type=int, required=False, default=1, help="Number of instances of the built-in collective pattern")
+    parser.add_argument("--chunk_size", action="store", type=float, required=False, default=None, help="Chunk size in bytes (default: that of the collective)")
     parser.add_argument("--synthesizer", action="store", type=str, required=True, help="Name of synthesis algorithm")
     parser.add_argument("--save", action="store", type=str, required=False, help="Name to save output csv")
     parser.add_argument("--verbose", action="store_true", required=False, help="Verbose")
     parser.add_argument("--gen_video", action="store_true", required=False, help="Generate video")
     parser.add_argument("--show", action="store_true", required=False, help="Show animation")
     parser.add_argument("--seed", action="store", type=int, required=False, default=2430, help="Random seed")
-    parser.add_argument("--seed", action="store", type=int, required=False, default=None, help="Random seed")
     parser.add_argument("--num_trials", action="store", type=int, required=False, default=1, help="Number of trials")
+    parser.add_argument("--time_budget", action="store", type=float, required=False, default=None, help="Soft wall clock budget in seconds per trial, after which the schedule is finished by earliest-arrival routes; the finish runs past the budget and can make the collective up to about twice as long")
+    parser.add_argument("--batched", action="store_true", required=False, help="Match all free links at each time point in one pass (tacos, greedy_tacos, multiple_tacos)")
     # Algorithm-specific arguments
     parser.add_argument("--num_beams", action="store", type=int, required=False, default=1, help="Beam width for beam search")
     # parser.add_argument("--fitness_type", action="store", type=str, required=False, default="chunk_count", help="Fitness function for beam serach")
     parser.add_argument("--temperature", action="store", type=float, required=False, default=0., help="Temperature for beam search")
+    parser.add_argument("--warm_start", action="store_true", required=False, help="Start the ILP from a greedy_tacos schedule and bound it by its collective time")
+    parser.add_argument("--timestep", action="store", type=float, required=False, default=None, help="Timestep in ns of the time-expanded network (default: smallest link delay)")
+    parser.add_argument("--workers", action="store", type=int, required=False, default=1, help="Number of worker processes (multiple_tacos, beam, hierarchical)")
+    parser.add_argument("--cluster_size", action="store", type=int, required=False, default=256, help="Largest number of NPUs per cluster of hierarchical synthesis")
+    parser.add_argument("--cluster_synthesizer", action="store", type=str, required=False, default="tacos", help="Synthesizer of each cluster of hierarchical synthesis (tacos, greedy_tacos)")
+    parser.add_argument("--instance_synthesizer", action="store", type=str, required=False, default="tacos", help="Synthesizer of the first instance of pipelined synthesis (tacos, greedy_tacos, symmetric)")
+    parser.add_argument("--interval", action="store", type=float, required=False, default=None, help="Shift in ns between consecutive instances of pipelined synthesis (default: busy time of the busiest link in one instance)")
+    parser.add_argument("--variants", action="store", type=int, required=False, default=1, help="Number of schedules of the first instance that pipelined synthesis alternates between")
+    parser.add_argument("--schedule", action="store", type=str, required=False, default=None, help="Result csv whose schedule retime recomputes the times of")
+    parser.add_argument("--retime_threshold", action="store", type=float, required=False, default=None, help="Largest relative slowdown of the retimed schedule before retime synthesizes again with tacos (default: never)")
+    parser.add_argument("--cache", action="store_true", required=False, help="Reuse the result of an identical synthesis problem with the same seed, and cache new results once they are verified")
+    parser.add_argument("--cache_dir", action="store", type=str, required=False, default=RESULT_CACHE_DIR, help="Directory of the result cache")
+    parser.add_argument("--cache_size", action="store", type=float, required=False, default=1024, help="Largest total size in MB of the result cache, beyond which the least recently used results are evicted")
     args = parser.parse_args()
     random.seed(args.seed)
     np.random.seed(args.seed)
@@ -76,56 +101,100 @@ def main():
     if os.path.exists(args.collective):
         collective = Collective(filename=args.collective)
     elif args.collective=="all_gather":
-        collective = AllGather(npus_count=topology.num_nodes, collectives_count=1)
+        collective = AllGather(npus_count=topology.num_nodes, collectives_count=args.collectives_count)
     elif args.collective=="all_to_all":
-        collective = AllToAll(npus_count=topology.num_nodes, collectives_count=1)
+        collective = AllToAll(npus_count=topology.num_nodes, collectives_count=args.collectives_count)
     elif match := re.match(r"^scatter_(\d+)$",args.collective):
-        collective = Scatter(npus_count=topology.num_nodes, src=int(match.group(1)), collectives_count=1)
+        collective = Scatter(npus_count=topology.num_nodes, src=int(match.group(1)), collectives_count=args.collectives_count)
     elif match := re.match(r"^broadcast_(\d+)$",args.collective):
-        collective = Broadcast(npus_count=topology.num_nodes, src=int(match.group(1)), collectives_count=1)
+        collective = Broadcast(npus_count=topology.num_nodes, src=int(match.group(1)), collectives_count=args.collectives_count)
     elif match := re.match(r"^gather_(\d+)$",args.collective):
-        collective = Gather(npus_count=topology.num_nodes, dest=int(match.group(1)), collectives_count=1)
+        collective = Gather(npus_count=topology.num_nodes, dest=int(match.group(1)), collectives_count=args.collectives_count)
     else:
         raise FileNotFoundError(f"Cannot find {args.collective}")
+    if args.chunk_size is not None:
+        collective.chunk_size = args.chunk_size
     ####################################################################################################
     # SYNTHESIZER
     ####################################################################################################
     seeds = [random.randint(0,2**32-1) for _ in range(args.num_trials)]
+    cache = ResultCache(cache_dir=args.cache_dir, max_bytes=int(args.cache_size*(1<<20))) if args.cache else None
+    # arguments that can change the result, except the problem itself, which the cache key hashes by content
+    parameters = {key: value for key, value in vars(args).items() if key not in ("topology", "collective", "synthesizer", "save", "verbose", "gen_video", "show", "seed", "num_trials", "cache", "cache_dir", "cache_size")}
+    if args.schedule is not None:
+        with open(args.schedule, mode="rb") as f:
+            parameters["schedule"] = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
     for trial in range(1,args.num_trials+1):
+        if cache is not None:
+            key = ResultCache.key(topology, collective, args.synthesizer, parameters, seeds[trial-1])
+            if cache.get(key, os.path.join(args.save, f"result_{trial}.csv")):
+                print("Cached Result:",key)
+                print("Collective Time:",max((receive_time for _, _, _, receive_time in read_schedule(os.path.join(args.save, f"result_{trial}.csv"))), default=0),"ns")
+                if args.gen_video:
+                    animate_collective(os.path.join(args.save, f"result_{trial}.csv"), save_name=os.path.join(args.save, f"result_{trial}.mp4"), show=args.show)
+                continue
         timer = Timer(name="Synthesizer")
         timer.start()
+        # the budget covers the whole trial, including building the synthesizer (e.g., the warm start and ILP model)
+        deadline = Deadline(args.time_budget)
         if args.synthesizer=="naive":
             synthesizer = NaiveSynthesizer(topology=topology,collective=collective,seed=seeds[trial-1])
-            synthesizer.solve()
+            synthesizer.solve(time_budget=deadline.remaining())
         elif args.synthesizer=="tacos":
-            synthesizer = TACOSSynthesizer(topology=topology,collective=collective,seed=seeds[trial-1])
-            synthesizer.solve()
+            synthesizer = TACOSSynthesizer(topology=topology,collective=collective,batched=args.batched,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
         elif args.synthesizer=="greedy_tacos":
-            synthesizer = GreedyTACOSSynthesizer(topology=topology,collective=collective)
-            synthesizer.solve()
+            synthesizer = GreedyTACOSSynthesizer(topology=topology,collective=collective,batched=args.batched)
+            synthesizer.solve(time_budget=deadline.remaining())
         elif args.synthesizer=="multiple_tacos":
-            synthesizer = MultipleTACOSSynthesizer(topology=topology,collective=collective,num_beams=args.num_beams,seed=seeds[trial-1])
-            synthesizer.solve()
+            synthesizer = MultipleTACOSSynthesizer(topology=topology,collective=collective,num_beams=args.num_beams,batched=args.batched,workers=args.workers,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
         elif args.synthesizer=="beam_chunk":
-            synthesizer = BeamSynthesizer(topology=topology,collective=collective,num_beams=args.num_beams,fitness_type="chunk_count",temperature=args.temperature,seed=seeds[trial-1])
-            synthesizer.solve()
+            synthesizer = BeamSynthesizer(topology=topology,collective=collective,num_beams=args.num_beams,fitness_type="chunk_count",temperature=args.temperature,workers=args.workers,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
         elif args.synthesizer=="beam_shortest":
-            synthesizer = BeamSynthesizer(topology=topology,collective=collective,num_beams=args.num_beams,fitness_type="shortest_path",temperature=args.temperature,seed=seeds[trial-1])
-            synthesizer.solve()
+            synthesizer = BeamSynthesizer(topology=topology,collective=collective,num_beams=args.num_beams,fitness_type="shortest_path",temperature=args.temperature,workers=args.workers,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
+        elif args.synthesizer=="ten":
+            synthesizer = TENSynthesizer(topology=topology,collective=collective,timestep=args.timestep,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
+            synthesizer.write_ten(os.path.join(args.save, f"result_{trial}_ten.csv"))
         elif args.synthesizer=="ilp":
-            synthesizer = ILPSynthesizer(topology=topology,collective=collective)
-            synthesizer.solve(verbose=args.verbose,filename=os.path.join(args.save, f"result_{trial}.lp"),time_limit=60)
+            synthesizer = ILPSynthesizer(topology=topology,collective=collective,warm_start=args.warm_start)
+            synthesizer.solve(verbose=args.verbose,filename=os.path.join(args.save, f"result_{trial}.lp"),time_limit=deadline.remaining() if args.time_budget is not None else 60)
             synthesizer.write(os.path.join(args.save, f"result_{trial}.sol"))
+        elif args.synthesizer=="ilp_ten":
+            synthesizer = TENILPSynthesizer(topology=topology,collective=collective,timestep=args.timestep,seed=seeds[trial-1])
+            synthesizer.solve(verbose=args.verbose,filename=os.path.join(args.save, f"result_{trial}.lp"),time_limit=deadline.remaining() if args.time_budget is not None else 60)
+            synthesizer.write(os.path.join(args.save, f"result_{trial}.sol"))
+            synthesizer.write_ten(os.path.join(args.save, f"result_{trial}_ten.csv"))
+        elif args.synthesizer=="hierarchical":
+            synthesizer = HierarchicalSynthesizer(topology=topology,collective=collective,cluster_size=args.cluster_size,synthesizer=args.cluster_synthesizer,batched=args.batched,workers=args.workers,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
+        elif args.synthesizer=="symmetric":
+            synthesizer = SymmetricSynthesizer(topology=topology,collective=collective,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
+        elif args.synthesizer=="pipelined":
+            synthesizer = PipelinedSynthesizer(topology=topology,collective=collective,collectives_count=args.collectives_count,synthesizer=args.instance_synthesizer,interval=args.interval,variants=args.variants,batched=args.batched,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
+        elif args.synthesizer=="retime":
+            if args.schedule is None:
+                raise ValueError("retime requires --schedule")
+            synthesizer = RetimingSynthesizer(topology=topology,collective=collective,schedule=read_schedule(args.schedule),threshold=args.retime_threshold,batched=args.batched,seed=seeds[trial-1])
+            synthesizer.solve(time_budget=deadline.remaining())
         else:
             raise NotImplementedError(f"Synthesizer {args.synthesizer} not supported")
         timer.stop()
         print("Collective Time:",synthesizer.current_time,"ns")
         print("Synthesis Time:",timer.get_time(),"s")
         synthesizer.write_csv(os.path.join(args.save, f"result_{trial}.csv"),synthesis_time=timer.get_time())
-        if args.synthesizer=="ilp":
+        # a cached result is reused without synthesis, so every result is verified before it is cached
+        if args.synthesizer in ("ilp", "ilp_ten", "hierarchical", "symmetric", "pipelined", "retime") or cache is not None:
             if not verify_collective(os.path.join(args.save, f"result_{trial}.csv"), topology=topology, collective=collective):
                 os.remove(os.path.join(args.save, f"result_{trial}.csv"))
                 raise ValueError(f"Synthesized algorithm is invalid!")
+        if cache is not None:
+            cache.put(key, os.path.join(args.save, f"result_{trial}.csv"))
         if args.gen_video:
             animate_collective(os.path.join(args.save, f"result_{trial}.csv"), save_name=os.path.join(args.save, f"result_{trial}.mp4"), show=args.show)
 
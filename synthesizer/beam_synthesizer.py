@@ -1,11 +1,13 @@
 import csv
 import random
+import traceback
+import multiprocessing
 import numpy as np
-from copy import deepcopy
 from collections import defaultdict
-import networkx as nx
 from helper.typing import *
+from helper.deadline import Deadline
 from topology.topology import Topology
+from topology.shortest_paths import get_shortest_paths, SHORTEST_PATHS_CACHE_DIR
 from collective.collective import Collective
 from synthesizer.tacos_synthesizer import TACOSSynthesizer
 
@@ -15,68 +17,223 @@ def softmax(x, temperature=1.0):
     x = np.exp(x)      
     return x / np.sum(x)
 
+def beam_worker(connection, beam_kwargs: dict) -> None:
+    """
+    Worker process of a BeamWorkerPool. Mirrors the beam of a BeamSynthesizer built from the same arguments.
+
+    :param connection: pipe to the main process
+    :param beam_kwargs: BeamSynthesizer arguments
+    """
+    beam = BeamSynthesizer(**beam_kwargs)
+    while True:
+        command, payload = connection.recv()
+        try:
+            if command=="expand":
+                _, matches, keys, fitnesses = beam.expand(payload)
+                connection.send(("ok", list(zip(matches, keys, fitnesses))))
+            elif command=="select":
+                beam.apply_selections(payload)
+            elif command=="close":
+                break
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+
+class BeamWorkerPool:
+    """
+    Process pool that rolls out beam instances in parallel.
+    The topology and collective are shipped to each worker once at startup; afterwards only
+    (parent, seed) requests, the resulting matches, and fitnesses cross process boundaries.
+    """
+    def __init__(self, workers: int, beam_kwargs: dict):
+        """
+        Start the worker processes.
+
+        :param workers: number of worker processes
+        :param beam_kwargs: BeamSynthesizer arguments, used by each worker to build its mirror of the beam
+        """
+        context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for _ in range(workers):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=beam_worker, args=(worker_connection, beam_kwargs), daemon=True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def expand(self, requests: List[Tuple[int,Optional[int]]]) -> List[Tuple[List[Tuple[LinkId,ChunkId]],bytes,Optional[float]]]:
+        """
+        Split the requests into contiguous slices, one per worker, so results come back in request order.
+
+        :param requests: (parent index, seed) rollouts
+        :return: (matches, state key, fitness) of every rollout
+        """
+        slices = np.array_split(np.arange(len(requests)), len(self.connections))
+        for connection, indices in zip(self.connections, slices):
+            connection.send(("expand", [requests[i] for i in indices]))
+        results = []
+        for connection in self.connections:
+            status, payload = connection.recv()
+            if status=="error":
+                raise RuntimeError(f"Beam worker failed:\n{payload}")
+            results.extend(payload)
+        return results
+
+    def apply_selections(self, selections: List[Tuple[int,Optional[int],List[Tuple[LinkId,ChunkId]]]]) -> None:
+        for connection in self.connections:
+            connection.send(("select", selections))
+
+    def close(self) -> None:
+        for connection in self.connections:
+            connection.send(("close", None))
+        for process in self.processes:
+            process.join()
+
 class BeamSynthesizer:
-    def __init__(self, topology: Topology, collective: Collective, discretize=False, num_beams=1, fitness_type="chunk_count", temperature=0., seed=None):
+    def __init__(self, topology: Topology, collective: Collective, discretize=False, num_beams=1, fitness_type="chunk_count", temperature=0., workers=1, deduplicate=True, cache_dir=SHORTEST_PATHS_CACHE_DIR, seed=None):
+        self.beam_kwargs = dict(topology=topology, collective=collective, discretize=discretize, num_beams=num_beams, fitness_type=fitness_type, temperature=temperature, deduplicate=deduplicate, cache_dir=cache_dir, seed=seed)
+        self.workers = workers
+        self.deduplicate = deduplicate
         self.rng = np.random.default_rng(seed)
         self.num_beams = num_beams
-        seeds = [self.rng.integers(0,2**32-1) for _ in range(self.num_beams)]
+        seeds = [int(self.rng.integers(0,2**32-1)) for _ in range(self.num_beams)]
         self.instances = [
             TACOSSynthesizer(topology=topology, collective=collective, discretize=discretize, seed=seeds[i]) for i in range(self.num_beams)
         ]
         self.fitness_type = fitness_type
         self.temperature = temperature
         self.shortest_paths = None
+        if self.fitness_type=="shortest_path":
+            self.shortest_paths = get_shortest_paths(self.instances[0].state.compiled, cache_dir=cache_dir)
+            for instance in self.instances:
+                instance.state.track_nearest_holders(self.shortest_paths)
 
     def compute_fitness(self, instance: TACOSSynthesizer) -> float:
         # A: total number of chunks each has
         # B: link utilization
         # C: weighting by degree
         # D: max of shortest path distances of precondition to postcondition
+        # chunk_count and shortest_path are maintained by the state as matches are applied
         if self.fitness_type=="chunk_count":
-            return sum(len(instance.get_chunks_at_node(node,instance.current_time)) for node in instance.nodes)
+            return instance.state.num_arrivals
         elif self.fitness_type=="shortest_path":
-            if self.shortest_paths is None:
-                # Uses Floyd-Warshall, but could change to use Dijkstra, Bellman-Ford, or Johnson
-                G = instance.topology.G
-                for src, dest in G.edges:
-                    G.add_edge(src, dest, link_delay=instance.topology.get_delay(edge=(src,dest)))
-                self.shortest_paths = nx.floyd_warshall_numpy(G, weight="link_delay")
-            # For each postcondition, get the shortest distance to the nearest chunk
-            preconditions = defaultdict(list)
-            for node, chunks in {node:set(instance.get_chunks_at_node(node,instance.current_time)) for node in instance.nodes}.items():
-                for chunk in chunks:
-                    preconditions[chunk].append(node)
-            distances = []
-            for chunk, node in instance.collective.postcondition:
-                distances.append(min(self.shortest_paths[node,candidate_node] for candidate_node in preconditions[chunk]))
-            return -max(distances)
+            # For each postcondition, the shortest distance from the nearest node holding the chunk
+            state = instance.state
+            return -float(np.max(state.nearest_holder_distance[state.postcondition]))
         else:
             raise ValueError(f"Fitness function not supported: {self.fitness_type}")
 
-    def solve(self) -> None:
-        while not all(instance.satisfied() for instance in self.instances):
-            population = []
-            for instance in self.instances:
-                if instance.satisfied():
-                    population.append(instance)
-                else:
-                    for _ in range(self.num_beams):
-                        instance_copy = deepcopy(instance)
-                        while not instance_copy.satisfied():
-                            possible_matches = instance_copy.get_possible_link_chunk_matches()
-                            if len(possible_matches)==0:
-                                instance_copy.step()
-                                break
-                            else:
-                                chosen_edge, chosen_chunk = instance_copy.rng.choice(possible_matches)
-                                instance_copy.match(edge=chosen_edge, chunk=chosen_chunk)
-                        population.append(instance_copy)
-            population_fitnesses = [self.compute_fitness(instance) for instance in population]
-            if self.temperature==0:
-                self.instances = [population[i] for i in np.argpartition(population_fitnesses,-self.num_beams)[-self.num_beams:]]
+    def expand(self, requests: List[Tuple[int,Optional[int]]]) -> Tuple[List[TACOSSynthesizer],List[List[Tuple[LinkId,ChunkId]]],List[bytes],List[Optional[float]]]:
+        """
+        Roll out a copy of a parent instance by one time point for every request.
+        Requests with seed None are finished parents that carry over unchanged.
+        With deduplicate, a rollout that reaches the same state as an earlier one is not scored.
+
+        :param requests: (parent index, seed) rollouts
+        :return: children, the matches each made, their state keys, and their fitnesses (None for duplicates)
+        """
+        children, matches, keys, fitnesses = [], [], [], []
+        transpositions = set()
+        for parent, seed in requests:
+            if seed is None:
+                child, child_matches = self.instances[parent], []
+            else:
+                child = self.instances[parent].copy(seed=seed)
+                child_matches = child.solve_time_point()
+            key = child.state.state_key()
+            children.append(child)
+            matches.append(child_matches)
+            keys.append(key)
+            if self.deduplicate and key in transpositions:
+                fitnesses.append(None)
+            else:
+                transpositions.add(key)
+                fitnesses.append(self.compute_fitness(child))
+        return children, matches, keys, fitnesses
+
+    def apply_selections(self, selections: List[Tuple[int,Optional[int],List[Tuple[LinkId,ChunkId]]]]) -> None:
+        """
+        Rebuild the beam from selected rollouts by replaying their matches on copies of their parents.
+
+        :param selections: (parent index, seed, matches) of each selected rollout
+        """
+        instances = []
+        for parent, seed, matches in selections:
+            if seed is None:
+                instances.append(self.instances[parent])
             else:
-                self.instances = self.rng.choice(population,p=softmax(population_fitnesses,temperature=self.temperature),replace=False,size=self.num_beams)
+                child = self.instances[parent].copy(seed=seed)
+                child.replay_time_point(matches)
+                instances.append(child)
+        self.instances = instances
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Run the beam search until every instance is satisfied.
+        Once time_budget seconds have passed, the search stops and keeps only the satisfied instances;
+        if none is satisfied yet, the fittest instance is finished by SynthesisState.complete().
+        The budget is a soft limit, as for the TACOS rollouts.
+
+        :param time_budget: soft wall clock budget in seconds (None for no budget)
+        """
+        deadline = Deadline(time_budget)
+        pool = BeamWorkerPool(workers=self.workers, beam_kwargs=self.beam_kwargs) if self.workers>1 else None
+        try:
+            while not all(instance.satisfied() for instance in self.instances):
+                if deadline.expired():
+                    self.stop_at_incumbent()
+                    break
+                # seeds are drawn here regardless of workers, so results only depend on the seed
+                requests = []
+                for parent, instance in enumerate(self.instances):
+                    if instance.satisfied():
+                        requests.append((parent, None))
+                    else:
+                        requests.extend((parent, int(self.rng.integers(0,2**32-1))) for _ in range(self.num_beams))
+                if pool is None:
+                    population, population_matches, population_keys, population_fitnesses = self.expand(requests)
+                else:
+                    results = pool.expand(requests)
+                    population_matches = [matches for matches, _, _ in results]
+                    population_keys = [key for _, key, _ in results]
+                    population_fitnesses = [fitness for _, _, fitness in results]
+                # transposition table: keep the first rollout reaching each state
+                candidates = []
+                transpositions = set()
+                for i, key in enumerate(population_keys):
+                    if self.deduplicate and key in transpositions:
+                        continue
+                    transpositions.add(key)
+                    candidates.append(i)
+                candidates = np.array(candidates)
+                candidate_fitnesses = [population_fitnesses[i] for i in candidates]
+                num_selected = min(self.num_beams, len(candidates))
+                if self.temperature==0:
+                    selected = candidates[np.argpartition(candidate_fitnesses,-num_selected)[-num_selected:]]
+                else:
+                    selected = candidates[self.rng.choice(len(candidates),p=softmax(candidate_fitnesses,temperature=self.temperature),replace=False,size=num_selected)]
+                if pool is None:
+                    self.instances = [population[i] for i in selected]
+                else:
+                    selections = [requests[i]+(population_matches[i],) for i in selected]
+                    pool.apply_selections(selections)
+                    self.apply_selections(selections)
+        finally:
+            if pool is not None:
+                pool.close()
     
+    def stop_at_incumbent(self) -> None:
+        """
+        Reduce the beam to its complete schedules, finishing the fittest instance cheaply if there are none.
+        """
+        satisfied = [instance for instance in self.instances if instance.satisfied()]
+        if len(satisfied)==0:
+            fittest = max(self.instances, key=self.compute_fitness)
+            # a zero budget goes straight to SynthesisState.complete()
+            fittest.solve(time_budget=0)
+            satisfied = [fittest]
+        self.instances = satisfied
+
     @property
     def current_time(self):
         return np.min([instance.current_time for instance in self.instances])
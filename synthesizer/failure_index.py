@@ -0,0 +1,272 @@
+import random
+import multiprocessing
+import numpy as np
+from collections import defaultdict
+from helper.typing import *
+from topology.topology import Topology
+from topology.automorphism import regular_automorphism_group
+from collective.collective import Collective
+from synthesizer.tacos_synthesizer import TACOSSynthesizer
+from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
+
+
+def synthesize_failure_scenario(task: Tuple[Topology,Collective,str,bool,int]) -> Optional[List[Event]]:
+    """
+    Synthesize the collective on the topology left by a failure.
+
+    :param task: (topology without the failed link or NPU, collective without the failed NPU, synthesizer name, batched, seed)
+    :return: event history, or None if the collective cannot be completed without the failed link or NPU
+    """
+    topology, collective, synthesizer, batched, seed = task
+    if synthesizer=="tacos":
+        instance = TACOSSynthesizer(topology=topology, collective=collective, batched=batched, seed=seed)
+    else:
+        instance = GreedyTACOSSynthesizer(topology=topology, collective=collective, batched=batched)
+    try:
+        instance.solve()
+    except ValueError:
+        return None
+    return instance.event_history
+
+
+class FailureIndex:
+    """
+    Schedules of a collective for every single-link (and optionally single-NPU) failure of a topology, so that
+    failing over is a lookup rather than a synthesis.
+
+    Failures that an automorphism of the topology maps onto each other are synthesized once, if the automorphism
+    also maps the collective onto itself (e.g., the links of a torus in one direction for All-Gather): the schedule
+    of the other failure is the image of the synthesized one. Automorphisms are taken from the regular group of
+    regular_automorphism_group(). When an NPU fails, the chunks that only it starts with are lost and the others
+    are delivered to the remaining NPUs that need them.
+
+    The index is stored as a single .npz file (see save() and load()).
+    """
+    def __init__(self, node_list: List[NpuId], chunk_list: List[ChunkId], permutations: np.ndarray, chunk_permutations: np.ndarray,
+                 indptr: np.ndarray, feasible: np.ndarray, events: Dict[str, np.ndarray],
+                 link_scenarios: Dict[LinkId, Tuple[int,int]], node_scenarios: Dict[NpuId, Tuple[int,int]]):
+        """
+        :param node_list: NPU ids, in node index order
+        :param chunk_list: chunk ids, in chunk index order
+        :param permutations: (automorphisms x NPUs) image of every node index under each automorphism, the identity first
+        :param chunk_permutations: (automorphisms x chunks) image of every chunk index under each automorphism
+        :param indptr: the events of scenario s are events[...][indptr[s]:indptr[s+1]]
+        :param feasible: whether the collective can be completed in each scenario
+        :param events: "src", "dest" (node indices), "chunk" (chunk indices), "send", and "receive" of the events of all scenarios
+        :param link_scenarios: scenario and automorphism that give the schedule of each failed link
+        :param node_scenarios: scenario and automorphism that give the schedule of each failed NPU
+        """
+        self.node_list = node_list
+        self.chunk_list = chunk_list
+        self.permutations = permutations
+        self.chunk_permutations = chunk_permutations
+        self.indptr = indptr
+        self.feasible = feasible
+        self.events = events
+        self.link_scenarios = link_scenarios
+        self.node_scenarios = node_scenarios
+
+    @property
+    def num_scenarios(self) -> int:
+        return len(self.feasible)
+
+    @classmethod
+    def build(cls, topology: Topology, collective: Collective, node_failures=False, symmetry=True, synthesizer="tacos", batched=False, workers=1, seed=None) -> "FailureIndex":
+        """
+        Synthesize the schedules of all single-link (and optionally single-NPU) failures.
+
+        :param topology: topology
+        :param collective: collective
+        :param node_failures: also index the failure of every NPU
+        :param symmetry: synthesize failures that are equivalent under the automorphisms of the topology once
+        :param synthesizer: synthesizer of each failure (tacos, greedy_tacos)
+        :param batched: match all free links at each time point in one pass (tacos, greedy_tacos)
+        :param workers: number of worker processes
+        :param seed: seed of the synthesizers
+        :return: index of the schedules
+        """
+        if synthesizer not in ("tacos", "greedy_tacos"):
+            raise ValueError(f"Synthesizer not supported: {synthesizer}")
+        rng = random.Random(seed)
+        compiled = topology.compile(collective.chunk_size)
+        chunk_list = sorted(collective.chunks)
+        group = regular_automorphism_group(topology, topology.automorphisms) if symmetry else None
+        permutations, chunk_permutations = cls._collective_automorphisms(compiled.node_index, chunk_list, collective, group)
+
+        # orbits of the links and NPUs, named by their first member
+        keys = compiled.src*compiled.num_nodes+compiled.dest
+        edge_order = np.argsort(keys)
+        link_orbits: Dict[int, Tuple[int,int]] = {}
+        for edge in range(compiled.num_edges):
+            if edge not in link_orbits:
+                images = edge_order[np.searchsorted(keys[edge_order], permutations[:, compiled.src[edge]]*compiled.num_nodes+permutations[:, compiled.dest[edge]])]
+                for element, image in enumerate(images.tolist()):
+                    link_orbits.setdefault(image, (edge, element))
+        node_orbits: Dict[int, Tuple[int,int]] = {}
+        for node in range(compiled.num_nodes if node_failures else 0):
+            if node not in node_orbits:
+                for element, image in enumerate(permutations[:, node].tolist()):
+                    node_orbits.setdefault(image, (node, element))
+
+        tasks, scenario_of = [], {}
+        for edge in sorted({edge for edge, _ in link_orbits.values()}):
+            G = topology.G.copy()
+            G.remove_edge(*compiled.edge_list[edge])
+            scenario_of["link", edge] = len(tasks)
+            tasks.append((Topology(G=G), collective, synthesizer, batched, rng.randint(0,2**32-1)))
+        for node in sorted({node for node, _ in node_orbits.values()}):
+            G = topology.G.copy()
+            G.remove_node(compiled.node_list[node])
+            scenario_of["node", node] = len(tasks)
+            tasks.append((Topology(G=G), cls._without_node(collective, compiled.node_list[node]), synthesizer, batched, rng.randint(0,2**32-1)))
+        if workers>1:
+            with multiprocessing.Pool(processes=workers) as pool:
+                solutions = pool.map(synthesize_failure_scenario, tasks, chunksize=1)
+        else:
+            solutions = [synthesize_failure_scenario(task) for task in tasks]
+
+        chunk_index = {chunk: i for i, chunk in enumerate(chunk_list)}
+        indptr = np.zeros(len(solutions)+1, dtype=np.int64)
+        np.cumsum([len(solution) if solution is not None else 0 for solution in solutions], out=indptr[1:])
+        flat = [event for solution in solutions if solution is not None for event in solution]
+        events = {
+            "src": np.array([compiled.node_index[src] for (src, _), _, _, _ in flat], dtype=np.int64),
+            "dest": np.array([compiled.node_index[dest] for (_, dest), _, _, _ in flat], dtype=np.int64),
+            "chunk": np.array([chunk_index[chunk] for _, chunk, _, _ in flat], dtype=np.int64),
+            "send": np.array([send_time for _, _, send_time, _ in flat], dtype=np.float64),
+            "receive": np.array([receive_time for _, _, _, receive_time in flat], dtype=np.float64),
+        }
+        link_scenarios = {compiled.edge_list[edge]: (scenario_of["link", orbit], element) for edge, (orbit, element) in link_orbits.items()}
+        node_scenarios = {compiled.node_list[node]: (scenario_of["node", orbit], element) for node, (orbit, element) in node_orbits.items()}
+        return cls(node_list=list(compiled.node_list), chunk_list=chunk_list, permutations=permutations, chunk_permutations=chunk_permutations,
+                   indptr=indptr, feasible=np.array([solution is not None for solution in solutions], dtype=bool), events=events,
+                   link_scenarios=link_scenarios, node_scenarios=node_scenarios)
+
+    @staticmethod
+    def _collective_automorphisms(node_index: Dict[NpuId,int], chunk_list: List[ChunkId], collective: Collective, group: Optional[np.ndarray]) -> Tuple[np.ndarray,np.ndarray]:
+        """
+        :param node_index: node index of every NPU
+        :param chunk_list: chunk ids, in chunk index order
+        :param collective: collective
+        :param group: (NPUs x NPUs) regular automorphism group of the topology, or None
+        :return: the automorphisms of the group that map the collective onto itself, the identity first, and the image
+                 of every chunk index under each (chunks with the same pre- and postconditions are mapped in order)
+        """
+        num_nodes, num_chunks = len(node_index), len(chunk_list)
+        identity = np.arange(num_nodes, dtype=np.int64)[None, :]
+        if group is None:
+            return identity, np.arange(num_chunks, dtype=np.int64)[None, :]
+        chunk_index = {chunk: i for i, chunk in enumerate(chunk_list)}
+        conditions = np.zeros((num_chunks, 2*num_nodes), dtype=bool)
+        for chunk, node in collective.precondition:
+            conditions[chunk_index[chunk], node_index[node]] = True
+        for chunk, node in collective.postcondition:
+            conditions[chunk_index[chunk], num_nodes+node_index[node]] = True
+        chunks_of = defaultdict(list)
+        for chunk, row in enumerate(np.packbits(conditions, axis=1)):
+            chunks_of[row.tobytes()].append(chunk)
+
+        permutations, chunk_permutations = [], []
+        for permutation in [identity[0]]+[row for row in group if not np.array_equal(row, identity[0])]:
+            # the pre- and postconditions of every chunk image, where node v moves to permutation[v]
+            inverse = np.empty(num_nodes, dtype=np.int64)
+            inverse[permutation] = np.arange(num_nodes)
+            images = np.packbits(conditions[:, np.concatenate([inverse, num_nodes+inverse])], axis=1)
+            taken = defaultdict(int)
+            chunk_permutation = np.empty(num_chunks, dtype=np.int64)
+            for chunk, row in enumerate(images):
+                key = row.tobytes()
+                if taken[key]>=len(chunks_of.get(key, ())):
+                    break
+                chunk_permutation[chunk] = chunks_of[key][taken[key]]
+                taken[key] += 1
+            else:
+                permutations.append(permutation)
+                chunk_permutations.append(chunk_permutation)
+        return np.array(permutations, dtype=np.int64), np.array(chunk_permutations, dtype=np.int64)
+
+    @staticmethod
+    def _without_node(collective: Collective, failed: NpuId) -> Collective:
+        """
+        :param collective: collective
+        :param failed: failed NPU
+        :return: collective of the chunks that another NPU starts with, delivered to the other NPUs that need them
+        """
+        holders, destinations = defaultdict(list), defaultdict(list)
+        for chunk, node in sorted(collective.precondition):
+            if node!=failed:
+                holders[chunk].append(node)
+        for chunk, node in sorted(collective.postcondition):
+            if node!=failed and chunk in holders and node not in holders[chunk]:
+                destinations[chunk].append(node)
+        remaining = Collective(chunk_size=collective.chunk_size)
+        for chunk in sorted(destinations):
+            for dest in destinations[chunk]:
+                remaining.add(id=chunk, src=holders[chunk][0], dest=dest)
+            for holder in holders[chunk][1:]:
+                remaining.add(id=chunk, src=holder, dest=destinations[chunk][0])
+        remaining.chunks_count = len(remaining.chunks)
+        return remaining
+
+    def _schedule(self, scenario: int, element: int) -> Optional[List[Event]]:
+        """
+        :param scenario: synthesized scenario
+        :param element: automorphism that maps it to the looked up failure
+        :return: image of the schedule of the scenario, or None if it is infeasible
+        """
+        if not self.feasible[scenario]:
+            return None
+        events = slice(self.indptr[scenario], self.indptr[scenario+1])
+        permutation, chunk_permutation = self.permutations[element], self.chunk_permutations[element]
+        node_list, chunk_list = self.node_list, self.chunk_list
+        srcs, dests = permutation[self.events["src"][events]].tolist(), permutation[self.events["dest"][events]].tolist()
+        chunks = chunk_permutation[self.events["chunk"][events]].tolist()
+        return [((node_list[src], node_list[dest]), chunk_list[chunk], send_time, receive_time)
+                for src, dest, chunk, send_time, receive_time in zip(srcs, dests, chunks, self.events["send"][events].tolist(), self.events["receive"][events].tolist())]
+
+    def lookup_link(self, link: LinkId) -> Optional[List[Event]]:
+        """
+        :param link: failed link
+        :return: schedule without the link, or None if the collective cannot be completed without it
+        """
+        if link not in self.link_scenarios:
+            raise KeyError(f"Link {link} is not indexed")
+        return self._schedule(*self.link_scenarios[link])
+
+    def lookup_node(self, node: NpuId) -> Optional[List[Event]]:
+        """
+        :param node: failed NPU
+        :return: schedule without the NPU, or None if the collective cannot be completed without it
+        """
+        if node not in self.node_scenarios:
+            raise KeyError(f"NPU {node} is not indexed")
+        return self._schedule(*self.node_scenarios[node])
+
+    def save(self, filename: str) -> None:
+        """
+        :param filename: .npz file to write
+        """
+        links = sorted(self.link_scenarios.items())
+        nodes = sorted(self.node_scenarios.items())
+        np.savez_compressed(filename,
+                            node_list=np.array(self.node_list, dtype=np.int64), chunk_list=np.array(self.chunk_list, dtype=np.int64),
+                            permutations=self.permutations, chunk_permutations=self.chunk_permutations,
+                            indptr=self.indptr, feasible=self.feasible, **{f"events_{key}": value for key, value in self.events.items()},
+                            links=np.array([link for link, _ in links], dtype=np.int64).reshape(-1, 2),
+                            link_scenarios=np.array([scenario for _, scenario in links], dtype=np.int64).reshape(-1, 2),
+                            nodes=np.array([node for node, _ in nodes], dtype=np.int64),
+                            node_scenarios=np.array([scenario for _, scenario in nodes], dtype=np.int64).reshape(-1, 2))
+
+    @classmethod
+    def load(cls, filename: str) -> "FailureIndex":
+        """
+        :param filename: .npz file written by save()
+        :return: index of the schedules
+        """
+        with np.load(filename) as data:
+            return cls(node_list=data["node_list"].tolist(), chunk_list=data["chunk_list"].tolist(),
+                       permutations=data["permutations"], chunk_permutations=data["chunk_permutations"],
+                       indptr=data["indptr"], feasible=data["feasible"],
+                       events={key: data[f"events_{key}"] for key in ("src", "dest", "chunk", "send", "receive")},
+                       link_scenarios={(src, dest): (scenario, element) for (src, dest), (scenario, element) in zip(data["links"].tolist(), data["link_scenarios"].tolist())},
+                       node_scenarios={node: (scenario, element) for node, (scenario, element) in zip(data["nodes"].tolist(), data["node_scenarios"].tolist())})
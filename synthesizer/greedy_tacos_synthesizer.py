@@ -3,11 +3,15 @@ import random
 import numpy as np
 from collections import defaultdict
 from helper.typing import *
+from helper.deadline import Deadline
 from topology.topology import Topology
+from topology.time_expanded_network import TimeExpandedNetwork
 from collective.collective import Collective
+from synthesizer.synthesis_state import SynthesisState
 
 class GreedyTACOSSynthesizer:
-    def __init__(self, topology: Topology, collective: Collective, discretize=False):
+    def __init__(self, topology: Topology, collective: Collective, discretize=False, batched=False, precondition_time: Optional[Dict[Tuple[ChunkId,NpuId],Time]] = None, link_available_from: Optional[Dict[LinkId,Time]] = None):
+        self.batched = batched
         self.topology = topology
         self.collective = collective
         self.chunk_size = collective.chunk_size
@@ -16,77 +20,80 @@ class GreedyTACOSSynthesizer:
         self.edges = self.topology.G.edges
         self.chunks = self.collective.chunks
 
+        self.ten = None
         if discretize:
             self.discretize()
 
-        self.current_time = 0
-        self.event_history: List[Event] = []
+        self.state = SynthesisState(topology=self.topology, collective=self.collective, ten=self.ten, precondition_time=precondition_time, link_available_from=link_available_from)
 
-        self.link_available_from = {edge:0 for edge in self.topology.G.edges}
-        self.chunk_arrival_at_node = {node:defaultdict(lambda:float('inf')) for node in self.topology.G.nodes}
-        for chunk, node in self.collective.precondition:
-            self.chunk_arrival_at_node[node][chunk] = 0
+    @property
+    def current_time(self) -> Time:
+        return self.state.current_time
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.state.event_history
     
     def satisfied(self) -> bool:
-        for chunk, node in self.collective.postcondition:
-            if self.chunk_arrival_at_node[node][chunk]>self.current_time:
-                return False
-        return True
+        return self.state.satisfied()
 
     def get_available_links(self) -> List[LinkId]:
-        return [edge for edge,available_from in self.link_available_from.items() if available_from<=self.current_time-self.topology.get_delay(edge,self.chunk_size)]
+        return [self.state.edge_list[edge] for edge in self.state.get_available_links()]
 
     def get_chunks_at_node(self, node: NpuId, at_time: Time) -> List[ChunkId]:
-        return [chunk for chunk, arrival_time in self.chunk_arrival_at_node[node].items() if arrival_time<=at_time]
+        return [self.state.chunk_list[chunk] for chunk in self.state.get_chunks_at_node(self.state.node_index[node], at_time)]
 
     def is_productive_link_chunk_match(self, edge: LinkId, chunk: ChunkId) -> bool:
-        src, dest = edge
-        return (
-            self.link_available_from[edge]<=self.current_time-self.topology.get_delay(edge,self.chunk_size) and # available
-            self.chunk_arrival_at_node[src][chunk]<=self.current_time-self.topology.get_delay(edge,self.chunk_size) and # chunk is available at source
-            self.chunk_arrival_at_node[dest][chunk]==float('inf') and # dest does not have it AND not enroute
-            (chunk, dest) in self.collective.postcondition # chunk is needed at dest
-        )
+        return self.state.is_productive_link_chunk_match(edge=self.state.edge_index[edge], chunk=self.state.chunk_index[chunk])
 
     def get_possible_link_chunk_matches(self) -> List[Tuple[LinkId,ChunkId]]:
-        matches = []
-        available_links = self.get_available_links()
-        for src, dest in available_links:
-            for chunk in self.get_chunks_at_node(src, self.current_time-self.topology.get_delay((src,dest),self.chunk_size)):
-                if self.is_productive_link_chunk_match(edge=(src, dest), chunk=chunk):
-                    matches.append(((src, dest), chunk))
-        return matches
+        edges, chunks = self.state.get_possible_link_chunk_matches()
+        return [(self.state.edge_list[edge], self.state.chunk_list[chunk]) for edge, chunk in zip(edges, chunks)]
 
     def match(self, edge: LinkId, chunk: ChunkId) -> None:
-        src, dest = edge
-        if not self.is_productive_link_chunk_match(edge=edge, chunk=chunk):
-            raise ValueError(f"Attempted invalid link chunk match: {edge}, {chunk}")
-        send_time = self.current_time - self.topology.get_delay(edge=edge, chunk_size=self.chunk_size)
-        receive_time = self.current_time
-        self.event_history.append((edge,chunk,send_time,receive_time))
-        self.link_available_from[edge] = receive_time
-        self.chunk_arrival_at_node[dest][chunk] = receive_time
+        self.state.match(edge=self.state.edge_index[edge], chunk=self.state.chunk_index[chunk])
 
     def step(self) -> None:
-        link_available_from_plus_delay = [self.link_available_from[edge]+self.topology.get_delay(edge=edge, chunk_size=self.chunk_size) for edge in self.link_available_from.keys()]
-        next_time = min(t for t in link_available_from_plus_delay if t>self.current_time)
-        self.current_time = next_time
+        self.state.advance(self.state.next_link_time())
+
+    def choose_chunk(self, edge: int, chunks: Set[int]) -> int:
+        # oldest chunk at the link source first
+        arrival_at_src = self.state.chunk_arrival_at_node[self.state.src[edge]]
+        return min(chunks, key=lambda chunk: (arrival_at_src[chunk], chunk))
 
-    def discretize(self) -> None:
-        pass
+    def discretize(self, timestep: Optional[Time] = None) -> None:
+        self.ten = TimeExpandedNetwork(self.topology.compile(self.chunk_size), timestep=timestep)
 
     def write_ten(self, filename: str) -> None:
-        pass
+        if self.ten is None:
+            raise ValueError("write_ten() requires a discretized synthesizer")
+        self.ten.write_ten(filename, self.event_history)
     
-    def solve(self) -> None:
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Run the rollout until the postcondition is satisfied.
+        Once time_budget seconds have passed, the rest of the schedule is finished by SynthesisState.complete().
+        The budget is a soft limit: it is checked between time points and the completion runs after it,
+        and the completed schedule is not tuned, so its collective time can be up to about twice as long.
+
+        :param time_budget: soft wall clock budget in seconds (None for no budget)
+        """
+        deadline = Deadline(time_budget)
         while not self.satisfied():
-            possible_matches = self.get_possible_link_chunk_matches()
-            if len(possible_matches)==0:
+            if deadline.expired():
+                self.state.complete()
+                break
+            if len(self.state.candidates)==0:
                 self.step()
+            elif self.batched:
+                # all free links at current_time, fastest first
+                links = sorted(self.state.available_links, key=lambda edge: (self.state.delay[edge], edge))
+                self.state.match_links(links, choose_chunk=self.choose_chunk)
             else:
-                edge_delays = [self.topology.get_delay(edge,self.chunk_size) for edge,_ in possible_matches]
-                chosen_edge, chosen_chunk = possible_matches[np.argmin(edge_delays)]
-                self.match(edge=chosen_edge, chunk=chosen_chunk)
+                # fastest available link with a productive chunk
+                chosen_edge = min((edge for edge in self.state.available_links if len(self.state.ready_chunks[edge])>0), key=lambda edge: (self.state.delay[edge], edge))
+                chosen_chunk = self.choose_chunk(chosen_edge, self.state.ready_chunks[chosen_edge])
+                self.state.match(edge=chosen_edge, chunk=chosen_chunk)
     
     def write_csv(self, filename: str, synthesis_time: float) -> None:
         edge_to_chunks = defaultdict(list)
@@ -0,0 +1,294 @@
+import csv
+import random
+import multiprocessing
+import numpy as np
+from collections import defaultdict, deque
+from helper.typing import *
+from helper.deadline import Deadline
+from topology.topology import Topology
+from topology.partition import partition_topology
+from collective.collective import Collective
+from synthesizer.tacos_synthesizer import TACOSSynthesizer
+from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
+from synthesizer.link_schedule import LinkSchedule
+from synthesizer.synthesis_state import earliest_arrival_routes
+
+def synthesize_cluster_phase(task: Tuple[Topology,Collective,Dict[Tuple[ChunkId,NpuId],Time],Dict[LinkId,Time],str,bool,int,Optional[Deadline]]) -> List[Event]:
+    """
+    Synthesize one phase of a cluster, continuing the schedule so far.
+    The phase gets the budget that is left when it starts, so serial phases do not each get the whole budget.
+
+    :param task: (cluster topology, phase collective, precondition arrival times, link free times, synthesizer name, batched, seed,
+                  deadline)
+    :return: event history of the phase
+    """
+    topology, collective, precondition_time, link_available_from, synthesizer, batched, seed, deadline = task
+    if synthesizer=="tacos":
+        instance = TACOSSynthesizer(topology=topology, collective=collective, batched=batched, seed=seed, precondition_time=precondition_time, link_available_from=link_available_from)
+    elif synthesizer=="greedy_tacos":
+        instance = GreedyTACOSSynthesizer(topology=topology, collective=collective, batched=batched, precondition_time=precondition_time, link_available_from=link_available_from)
+    else:
+        raise ValueError(f"Cluster synthesizer not supported: {synthesizer}")
+    instance.solve(time_budget=None if deadline is None else deadline.remaining())
+    return instance.event_history
+
+class HierarchicalSynthesizer:
+    """
+    Synthesis on a partitioned topology.
+
+    The topology is partitioned into clusters (see partition_topology()) and every chunk is routed over a
+    shortest-path tree of the cluster graph, from the clusters that start with it to the clusters that need it.
+    In phase r, every cluster independently synthesizes the delivery of the chunks r hops down their trees,
+    over its own links and the inter-cluster links into it, so the clusters of a phase use disjoint links.
+    A cluster delivers a chunk to the NPUs that need it and, if no NPU holding it is linked to a cluster it
+    forwards the chunk to, to the nearest NPU that is. TACOS only relays chunks through NPUs that need them,
+    so the NPUs on shortest paths to these need it too. Each phase starts from the arrival times and link free
+    times of the schedule so far, and is stitched in by list scheduling: in send order, each transmission takes
+    the earliest gap on its link after its src holds the chunk, which can only move it earlier.
+    """
+    def __init__(self, topology: Topology, collective: Collective, cluster_size: int = 256, synthesizer="tacos", batched=False, workers=1, seed=None):
+        self.rng = random.Random(seed)
+        self.synthesizer = synthesizer
+        self.batched = batched
+        self.workers = workers
+
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        self.compiled = self.topology.compile(self.chunk_size)
+        self.chunk_list: List[ChunkId] = sorted(self.chunks)
+        self.chunk_index: Dict[ChunkId, int] = {chunk: i for i, chunk in enumerate(self.chunk_list)}
+
+        self.cluster_size = cluster_size
+        self.clusters: List[List[NpuId]] = partition_topology(topology, self.cluster_size, seed=self.rng.randint(0,2**32-1))
+        self.cluster_nodes = [np.array([self.compiled.node_index[node] for node in cluster], dtype=np.int64) for cluster in self.clusters]
+        self.cluster_of = np.empty(self.compiled.num_nodes, dtype=np.int64)
+        for cluster, nodes in enumerate(self.cluster_nodes):
+            self.cluster_of[nodes] = cluster
+        # a cluster synthesizes over the links into its NPUs, which brings in the src NPUs of its inter-cluster links
+        self.cluster_topologies: List[Optional[Topology]] = []
+        for cluster in self.clusters:
+            links = list(self.topology.G.in_edges(cluster))
+            self.cluster_topologies.append(Topology(G=self.topology.G.edge_subgraph(links).copy()) if len(links)>0 else None)
+        self.linked_to_cluster = np.zeros((self.compiled.num_nodes, len(self.clusters)), dtype=bool)
+        self.linked_to_cluster[self.compiled.src, self.cluster_of[self.compiled.dest]] = True
+        self.cluster_successors: Dict[int, List[int]] = defaultdict(list)
+        for src, dest in sorted(set(zip(self.cluster_of[self.compiled.src].tolist(), self.cluster_of[self.compiled.dest].tolist()))):
+            if src!=dest:
+                self.cluster_successors[src].append(dest)
+
+        # (node, chunk) arrival times of the stitched schedule, and the busy intervals of each link
+        self.chunk_arrival_at_node = np.full((self.compiled.num_nodes, len(self.chunk_list)), np.inf)
+        self.postcondition = np.zeros(self.chunk_arrival_at_node.shape, dtype=bool)
+        for chunk, node in self.collective.precondition:
+            self.chunk_arrival_at_node[self.compiled.node_index[node], self.chunk_index[chunk]] = 0
+        for chunk, node in self.collective.postcondition:
+            self.postcondition[self.compiled.node_index[node], self.chunk_index[chunk]] = True
+        self.link_schedule = LinkSchedule(self.compiled)
+        self.events: List[Event] = []
+
+    def _route_chunks(self) -> Tuple[np.ndarray,np.ndarray]:
+        """
+        Route every chunk over a shortest-path tree of the cluster graph from the clusters that start with it.
+
+        :return: (clusters x chunks) tree depth of each cluster on a chunk's route (-1 if off the route),
+                 and the cluster it receives the chunk from (-1 if none)
+        """
+        num_clusters, num_chunks = len(self.clusters), len(self.chunk_list)
+        holds = np.zeros((num_clusters, num_chunks), dtype=bool)
+        needs = np.zeros((num_clusters, num_chunks), dtype=bool)
+        for chunk, node in self.collective.precondition:
+            holds[self.cluster_of[self.compiled.node_index[node]], self.chunk_index[chunk]] = True
+        for chunk, node in self.collective.postcondition:
+            needs[self.cluster_of[self.compiled.node_index[node]], self.chunk_index[chunk]] = True
+
+        depth = np.full((num_clusters, num_chunks), -1, dtype=np.int64)
+        parent = np.full((num_clusters, num_chunks), -1, dtype=np.int64)
+        # chunks that start in the same clusters share a tree
+        trees = defaultdict(list)
+        for chunk in range(num_chunks):
+            trees[tuple(np.flatnonzero(holds[:, chunk]).tolist())].append(chunk)
+        for roots, chunks in trees.items():
+            tree_depth = np.full(num_clusters, -1, dtype=np.int64)
+            tree_parent = np.full(num_clusters, -1, dtype=np.int64)
+            tree_depth[list(roots)] = 0
+            queue = deque(roots)
+            while queue:
+                cluster = queue.popleft()
+                for successor in self.cluster_successors[cluster]:
+                    if tree_depth[successor]<0:
+                        tree_depth[successor] = tree_depth[cluster]+1
+                        tree_parent[successor] = cluster
+                        queue.append(successor)
+            for chunk in chunks:
+                depth[list(roots), chunk] = 0
+                for cluster in np.flatnonzero(needs[:, chunk]).tolist():
+                    if tree_depth[cluster]<0:
+                        raise ValueError(f"Chunk {self.chunk_list[chunk]} cannot reach cluster {self.clusters[cluster]}")
+                    while depth[cluster, chunk]<0:
+                        depth[cluster, chunk] = tree_depth[cluster]
+                        parent[cluster, chunk] = tree_parent[cluster]
+                        cluster = tree_parent[cluster]
+        return depth, parent
+
+    def _phase_task(self, cluster: int, chunks: np.ndarray, children: List[List[int]], deadline: Optional[Deadline] = None) -> Optional[tuple]:
+        """
+        :param cluster: cluster index
+        :param chunks: indices of the chunks the cluster receives in this phase
+        :param children: clusters the cluster forwards each of these chunks to
+        :param deadline: deadline of the whole synthesis (None for no budget)
+        :return: synthesize_cluster_phase() task, or None if the cluster already holds everything it needs
+        """
+        nodes = self.cluster_nodes[cluster]
+        needed = self.postcondition[nodes][:, chunks] & (self.chunk_arrival_at_node[nodes][:, chunks]==np.inf)
+        topology = self.cluster_topologies[cluster]
+        if topology is None:
+            return None
+        # chunks can come from any NPU of the cluster topology that holds them, in or next to the cluster
+        sources = np.array([self.compiled.node_index[node] for node in topology.G.nodes], dtype=np.int64)
+        held = self.chunk_arrival_at_node[sources][:, chunks]!=np.inf
+        collective = Collective(chunk_size=self.chunk_size)
+        precondition_time = {}
+        for i in range(len(chunks)):
+            holders = sources[held[:, i]]
+            if not needed[:, i].all():
+                tree = self._shortest_path_tree(topology, holders)
+                # a chunk leaves for a child cluster from an NPU that holds it, or else from the nearest NPU linked to it
+                holding = np.concatenate([holders, nodes[needed[:, i]]])
+                for child in children[i]:
+                    if not self.linked_to_cluster[holding, child].any():
+                        exit_node = next(node for node in tree if self.linked_to_cluster[self.compiled.node_index[node], child])
+                        needed[:, i] |= nodes==self.compiled.node_index[exit_node]
+                # TACOS only relays a chunk through NPUs that need it, so the NPUs on the way need it too
+                for node in nodes[needed[:, i]].tolist():
+                    node = tree[self.compiled.node_list[node]]
+                    while node is not None and tree[node] is not None:
+                        needed[:, i] |= nodes==self.compiled.node_index[node]
+                        node = tree[node]
+            if not needed[:, i].any():
+                continue
+            chunk = self.chunk_list[chunks[i]]
+            for holder in holders.tolist():
+                collective.add(id=chunk, src=self.compiled.node_list[holder], dest=self.compiled.node_list[holder])
+                precondition_time[chunk, self.compiled.node_list[holder]] = float(self.chunk_arrival_at_node[holder, chunks[i]])
+            for node in nodes[needed[:, i]].tolist():
+                collective.add(id=chunk, src=self.compiled.node_list[holders[0]], dest=self.compiled.node_list[node])
+        if len(collective.chunks)==0:
+            return None
+        collective.chunks_count = len(collective.chunks)
+        link_available_from = {}
+        for edge in topology.G.edges:
+            if len(self.link_schedule.ends[self.compiled.edge_index[edge]])>0:
+                link_available_from[edge] = self.link_schedule.free_from(self.compiled.edge_index[edge])
+        return topology, collective, precondition_time, link_available_from, self.synthesizer, self.batched, self.rng.randint(0,2**32-1), deadline
+
+    def _shortest_path_tree(self, topology: Topology, holders: np.ndarray) -> Dict[NpuId, Optional[NpuId]]:
+        """
+        :param topology: cluster topology
+        :param holders: node indices that hold a chunk
+        :return: parent of every reachable NPU on a shortest path from the holders (None for the holders), in BFS order
+        """
+        tree = {self.compiled.node_list[holder]: None for holder in holders.tolist()}
+        queue = deque(tree)
+        while queue:
+            node = queue.popleft()
+            for successor in topology.G.successors(node):
+                if successor not in tree:
+                    tree[successor] = node
+                    queue.append(successor)
+        return tree
+
+    def _stitch_phase(self, events: List[Event]) -> None:
+        """
+        List-schedule the events of a phase in their send order.
+        """
+        for edge, chunk, _, _ in sorted(events, key=lambda event: event[2]):
+            edge, chunk = self.compiled.edge_index[edge], self.chunk_index[chunk]
+            start, receive_time = self.link_schedule.reserve(edge, self.chunk_arrival_at_node[self.compiled.src[edge], chunk])
+            dest = self.compiled.dest[edge]
+            self.chunk_arrival_at_node[dest, chunk] = min(self.chunk_arrival_at_node[dest, chunk], receive_time)
+            self.events.append((self.compiled.edge_list[edge], self.chunk_list[chunk], start, receive_time))
+
+    def _complete(self) -> None:
+        """
+        Finish the schedule cheaply over the whole topology: every chunk that is still needed is sent along its
+        earliest-arrival routes (see earliest_arrival_routes()), list-scheduled in earliest-arrival order.
+        """
+        missing = self.postcondition & (self.chunk_arrival_at_node==np.inf)
+        link_free = np.array([self.link_schedule.free_from(edge) for edge in range(self.compiled.num_edges)], dtype=np.float64)
+        edges, chunks = earliest_arrival_routes(self.chunk_arrival_at_node, link_free, self.compiled.delay,
+                                                self.compiled.src, self.compiled.dest, missing)
+        for edge, chunk in zip(edges.tolist(), chunks.tolist()):
+            start, receive_time = self.link_schedule.reserve(edge, self.chunk_arrival_at_node[self.compiled.src[edge], chunk])
+            self.chunk_arrival_at_node[self.compiled.dest[edge], chunk] = receive_time
+            self.events.append((self.compiled.edge_list[edge], self.chunk_list[chunk], start, receive_time))
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Synthesize the phases in order and stitch them into one schedule.
+        Every phase is part of the only schedule, so each one gets the budget that is left when it starts, and once
+        time_budget seconds have passed, the phases left are replaced by one completion over the whole topology.
+        The budget is a soft limit, as for the TACOS rollouts.
+
+        :param time_budget: soft wall clock budget in seconds (None for no budget)
+        """
+        deadline = Deadline(time_budget)
+        depth, parent = self._route_chunks()
+        pool = multiprocessing.Pool(processes=self.workers) if self.workers>1 else None
+        try:
+            for phase in range(int(depth.max(initial=0))+1):
+                if deadline.expired():
+                    self._complete()
+                    break
+                tasks = []
+                for cluster in range(len(self.clusters)):
+                    chunks = np.flatnonzero(depth[cluster]==phase)
+                    children = [np.flatnonzero(parent[:, chunk]==cluster).tolist() for chunk in chunks.tolist()]
+                    task = self._phase_task(cluster, chunks, children, deadline) if len(chunks)>0 else None
+                    if task is not None:
+                        tasks.append(task)
+                if pool is None:
+                    phases = [synthesize_cluster_phase(task) for task in tasks]
+                else:
+                    phases = pool.map(synthesize_cluster_phase, tasks, chunksize=1)
+                for events in phases:
+                    self._stitch_phase(events)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        missing = self.postcondition & (self.chunk_arrival_at_node==np.inf)
+        if missing.any():
+            node, chunk = np.argwhere(missing)[0]
+            raise ValueError(f"Node {self.compiled.node_list[node]} did not receive chunk {self.chunk_list[chunk]}")
+
+    @property
+    def current_time(self) -> Time:
+        return max((receive_time for _, _, _, receive_time in self.events), default=0)
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.events
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        edge_to_chunks = defaultdict(list)
+        for edge,chunk,send_time,receive_time in self.event_history:
+            edge_to_chunks[edge].append((chunk, send_time, receive_time))
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
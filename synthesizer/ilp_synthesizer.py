@@ -1,12 +1,52 @@
 import csv
+import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
+from collections import defaultdict
 from helper.typing import *
 from topology.topology import Topology
+from topology.compiled_topology import CompiledTopology
+from topology.shortest_paths import get_shortest_paths
 from collective.collective import Collective
+from collective.violations import find_violations
+from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
+
+def compute_send_windows(compiled: CompiledTopology, collective: Collective, chunk_list: List[ChunkId], upper_bound: Optional[Time] = None) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """
+    Bound when each chunk can usefully cross each link, from shortest-path delays and the pre/postconditions.
+    A chunk can only usefully cross link (src, dest) if src is reachable from a node that starts with the chunk,
+    dest does not start with it, and a node that needs it is reachable from dest (within upper_bound, if given).
+
+    :param compiled: compiled topology
+    :param collective: collective to synthesize
+    :param chunk_list: chunks, in index order
+    :param upper_bound: collective time the schedule must finish by (None for no bound)
+    :return: (chunks x links) feasibility mask, earliest send times, and latest send times (only meaningful with upper_bound)
+    """
+    chunk_index = {chunk: i for i, chunk in enumerate(chunk_list)}
+    shortest_paths = get_shortest_paths(compiled)
+    has_chunk = np.zeros((len(chunk_list), compiled.num_nodes), dtype=bool)
+    needs_chunk = np.zeros((len(chunk_list), compiled.num_nodes), dtype=bool)
+    for chunk, node in collective.precondition:
+        has_chunk[chunk_index[chunk], compiled.node_index[node]] = True
+    for chunk, node in collective.postcondition:
+        needs_chunk[chunk_index[chunk], compiled.node_index[node]] = True
+    needs_chunk &= ~has_chunk
+
+    # (chunks x nodes) distance from the nearest node with the chunk, and to the nearest node that needs it
+    dist_from_source = np.array([np.min(shortest_paths[sources], axis=0, initial=np.inf) for sources in has_chunk])
+    dist_to_dest = np.array([np.min(shortest_paths[:, dests], axis=1, initial=np.inf) for dests in needs_chunk])
+    earliest_send = dist_from_source[:, compiled.src]
+    latest_send = -dist_to_dest[:, compiled.dest] - compiled.delay
+    if upper_bound is not None:
+        latest_send += upper_bound
+    feasible = np.isfinite(earliest_send) & np.isfinite(latest_send) & ~has_chunk[:, compiled.dest]
+    if upper_bound is not None:
+        feasible &= earliest_send <= latest_send + 1e-9*upper_bound
+    return feasible, earliest_send, latest_send
 
 class ILPSynthesizer:
-    def __init__(self, topology: Topology, collective: Collective, big_num: float = 1e4):
+    def __init__(self, topology: Topology, collective: Collective, big_num: float = 1e4, upper_bound: Optional[Time] = None, warm_start: bool = False):
         self.topology = topology
         self.collective = collective
         self.chunk_size = collective.chunk_size
@@ -15,54 +55,158 @@ class ILPSynthesizer:
         self.edges = self.topology.G.edges
         self.chunks = self.collective.chunks
 
+        # the model is built over index arrays: nodes, links, and chunks are addressed by their position in
+        # compiled.node_list, compiled.edge_list, and chunk_list, and (node, chunk) by node*len(chunk_list)+chunk
+        self.compiled = self.topology.compile(self.chunk_size)
+        self.chunk_list: List[ChunkId] = sorted(self.chunks)
+        self.chunk_index: Dict[ChunkId, int] = {chunk: i for i, chunk in enumerate(self.chunk_list)}
+
         self.model = gp.Model("SynthesizeCollectiveAlgorithm")
         self.big_num = big_num
+        self.upper_bound = upper_bound
+        # a heuristic schedule bounds T, which tightens pruning and big-M values, and is loaded as the MIP start
+        self.start_events: Optional[List[Event]] = None
+        if warm_start:
+            heuristic = GreedyTACOSSynthesizer(topology=topology, collective=collective)
+            heuristic.solve()
+            self.start_events = heuristic.event_history
+            self.upper_bound = heuristic.current_time if upper_bound is None else min(upper_bound, heuristic.current_time)
 
+        self._prune_vars()
         self._initialize_vars()
         self._set_objective()
         self._set_constraints()
+        if self.start_events is not None:
+            self._set_start(self.start_events)
+
+    def _node_chunk_keys(self, pairs) -> np.ndarray:
+        return np.array([self.compiled.node_index[node]*len(self.chunk_list) + self.chunk_index[chunk] for chunk, node in pairs], dtype=np.int64)
+
+    def _prune_vars(self) -> None:
+        """
+        Find the sends and send pairs the model needs (see compute_send_windows()).
+        Two chunks a<b on a link need ordering variables only if both can cross it and, given upper_bound,
+        their send windows are close enough to overlap.
+        """
+        compiled = self.compiled
+        feasible, earliest_send, latest_send = compute_send_windows(compiled, self.collective, self.chunk_list, self.upper_bound)
+
+        # sends, ordered by link then chunk
+        self.send_edge, self.send_chunk = np.nonzero(feasible.T)
+        # (earliest, latest) send time of each send; any send outside it cannot help a schedule finishing by upper_bound
+        self.earliest_send = earliest_send[self.send_chunk, self.send_edge]
+        self.latest_send = latest_send[self.send_chunk, self.send_edge] if self.upper_bound is not None else np.full(len(self.send_edge), self.big_num)
+        self.send_delay = compiled.delay[self.send_edge]
+        self.send_src_key = compiled.src[self.send_edge]*len(self.chunk_list) + self.send_chunk
+        self.send_dest_key = compiled.dest[self.send_edge]*len(self.chunk_list) + self.send_chunk
+
+        # send pairs (a, b) on the same link with chunk_a<chunk_b, as indices into the sends
+        counts = np.bincount(self.send_edge, minlength=compiled.num_edges)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        pair_a, pair_b = [], []
+        for count, offset in zip(counts.tolist(), offsets.tolist()):
+            if count > 1:
+                a, b = np.triu_indices(count, k=1)
+                pair_a.append(a + offset)
+                pair_b.append(b + offset)
+        self.pair_a = np.concatenate(pair_a) if len(pair_a) > 0 else np.zeros(0, dtype=np.int64)
+        self.pair_b = np.concatenate(pair_b) if len(pair_b) > 0 else np.zeros(0, dtype=np.int64)
+        if self.upper_bound is not None:
+            # windows too far apart to overlap fix the order, so the pair needs no ordering variables
+            pair_delay = self.send_delay[self.pair_a]
+            overlapping = ((self.latest_send[self.pair_a] + pair_delay > self.earliest_send[self.pair_b])
+                           & (self.latest_send[self.pair_b] + pair_delay > self.earliest_send[self.pair_a]))
+            self.pair_a, self.pair_b = self.pair_a[overlapping], self.pair_b[overlapping]
 
     def _initialize_vars(self) -> None:
         self.total_time = self.model.addVar(vtype=GRB.CONTINUOUS, name="T")
-        self.receive_time = self.model.addVars(self.nodes, self.chunks, vtype=GRB.CONTINUOUS, name="receive")
-        self.send_time = self.model.addVars(self.edges, self.chunks, vtype=GRB.CONTINUOUS, name="send")
-        self.send_bool = self.model.addVars(self.edges, self.chunks, vtype=GRB.BINARY, name="used")
-        self.order_bool = self.model.addVars(self.edges, self.chunks, self.chunks, vtype=GRB.BINARY, name="order")
-        self.send_bool2 = self.model.addVars(self.edges, self.chunks, self.chunks, vtype=GRB.BINARY, name="used2")
-    
+        self.receive_time = self.model.addMVar(len(self.nodes)*len(self.chunk_list), vtype=GRB.CONTINUOUS, name="receive")
+        # sends stay in their windows through plain bounds, whether used or not, which bounds the big-M values of the ordering constraints
+        self.send_time = self.model.addMVar(len(self.send_edge), lb=self.earliest_send, ub=self.latest_send, vtype=GRB.CONTINUOUS, name="send")
+        self.send_bool = self.model.addMVar(len(self.send_edge), vtype=GRB.BINARY, name="used")
+        self.order_bool = self.model.addMVar(len(self.pair_a), vtype=GRB.BINARY, name="order")
+        self.send_bool2 = self.model.addMVar(len(self.pair_a), vtype=GRB.BINARY, name="used2")
+
     def _set_objective(self) -> None:
         self.model.setObjective(self.total_time, sense=GRB.MINIMIZE)
-    
+
     def _set_constraints(self) -> None:
+        precondition_keys = self._node_chunk_keys(self.collective.precondition)
+        postcondition_keys = self._node_chunk_keys(self.collective.postcondition)
+        needed_keys = np.setdiff1d(postcondition_keys, precondition_keys)
+        total_time = gp.MVar.fromvar(self.total_time)
+
         # All nodes receive precondition chunks at t=0
-        self.model.addConstrs((self.receive_time[node, chunk] == 0 for chunk, node in self.collective.precondition), name="precondition")
+        self.model.addConstr(self.receive_time[precondition_keys] == 0, name="precondition")
         # All postconditions must receive chunk from one neighbor
-        self.model.addConstrs((sum(self.send_bool[src, dest, chunk] for src, edge_dest in self.edges if edge_dest==dest) == 1 for chunk, dest in self.collective.postcondition if ((chunk, dest) not in self.collective.precondition)), name="postcondition")
-        # Total time is when all postconditions have been marked received 
-        self.model.addConstrs((self.receive_time[node, chunk] <= self.total_time for chunk, node in self.collective.postcondition), name="postcondition_time")
-        
-        # Given a send from i->j of chunk c, the src must have received the chunk before sending, and the arrival time must be send_time + delay
-        self.model.addConstrs(((self.send_bool[src, dest, chunk] == 1) >> (self.receive_time[src, chunk] <= self.send_time[src, dest, chunk]) for src, dest in self.edges for chunk in self.chunks), name="sender_possesses")
-        self.model.addConstrs(((self.send_bool[src, dest, chunk] == 1) >> (self.send_time[src, dest, chunk] + self.topology.get_delay((src,dest), self.chunk_size) == self.receive_time[dest, chunk]) for src, dest in self.edges for chunk in self.chunks), name="link_delay")
-        # Otherwise, set send_time to a large number
-        self.model.addConstrs(((self.send_bool[src, dest, chunk] == 0) >> (self.send_time[src, dest, chunk] == self.big_num) for src, dest in self.edges for chunk in self.chunks), name="send_default")
-
-
-        # Exactly one of order_bool must be true
-        self.model.addConstrs((self.order_bool[src, dest, chunk_a, chunk_b]+self.order_bool[src, dest, chunk_b, chunk_a] == 1 for src, dest in self.edges for chunk_a in self.chunks for chunk_b in self.chunks if chunk_a!=chunk_b), name="order_specified")
-        # send_bool2 is and of send_bools
-        self.model.addConstrs((self.send_bool2[src, dest, chunk_a, chunk_b] == gp.and_([self.send_bool[src, dest, chunk_a], self.send_bool[src, dest, chunk_b]]) for src, dest in self.edges for chunk_a in self.chunks for chunk_b in self.chunks if chunk_a!=chunk_b), name="send_conjunction")
-        # Based on order, choose constraint
-        self.model.addConstrs((
-            (self.send_bool2[src, dest, chunk_a, chunk_b] == 1) >> (self.send_time[src, dest, chunk_a]-self.send_time[src, dest, chunk_b] >= 
-            self.topology.get_delay((src,dest), self.chunk_size) - self.big_num*(1-self.order_bool[src, dest, chunk_b, chunk_a]))
-            for src, dest in self.edges for chunk_a in self.chunks for chunk_b in self.chunks if chunk_a!=chunk_b
-        ), name="overlap_pos")
-        self.model.addConstrs((
-            (self.send_bool2[src, dest, chunk_a, chunk_b] == 1) >> (self.send_time[src, dest, chunk_b]-self.send_time[src, dest, chunk_a] >= 
-            self.topology.get_delay((src,dest), self.chunk_size) - self.big_num*(1-self.order_bool[src, dest, chunk_a, chunk_b]))
-            for src, dest in self.edges for chunk_a in self.chunks for chunk_b in self.chunks if chunk_a!=chunk_b
-        ), name="overlap_neg")
+        sends_by_dest = np.argsort(self.send_dest_key, kind="stable")
+        starts = np.searchsorted(self.send_dest_key[sends_by_dest], needed_keys, side="left")
+        ends = np.searchsorted(self.send_dest_key[sends_by_dest], needed_keys, side="right")
+        send_bools = self.send_bool.tolist()
+        for key, start, end in zip(needed_keys.tolist(), starts.tolist(), ends.tolist()):
+            self.model.addLConstr(gp.LinExpr([1.]*(end-start), [send_bools[send] for send in sends_by_dest[start:end]]), GRB.EQUAL, 1, name=f"postcondition[{key}]")
+        # Total time is when all postconditions have been marked received
+        self.model.addConstr(self.receive_time[postcondition_keys] <= total_time, name="postcondition_time")
+
+        if len(self.send_edge) > 0:
+            # Given a send from i->j of chunk c, the src must have received the chunk before sending, and the arrival time must be send_time + delay
+            self.model.addGenConstrIndicator(self.send_bool, True, self.receive_time[self.send_src_key] - self.send_time, GRB.LESS_EQUAL, 0., name="sender_possesses")
+            self.model.addGenConstrIndicator(self.send_bool, True, self.send_time - self.receive_time[self.send_dest_key], GRB.EQUAL, -self.send_delay, name="link_delay")
+        if self.upper_bound is not None:
+            self.model.addConstr(self.total_time <= self.upper_bound, name="upper_bound")
+
+        if len(self.pair_a) > 0:
+            # order_bool is 1 if chunk_a is sent before chunk_b; pairs only exist for chunk_a<chunk_b, so both orders are covered
+            # send_bool2 is and of send_bools
+            self.model.addConstr(self.send_bool2 <= self.send_bool[self.pair_a], name="send_conjunction_a")
+            self.model.addConstr(self.send_bool2 <= self.send_bool[self.pair_b], name="send_conjunction_b")
+            self.model.addConstr(self.send_bool2 >= self.send_bool[self.pair_a] + self.send_bool[self.pair_b] - 1, name="send_conjunction")
+            # Based on order, choose constraint; both are relaxed unless both sends are used
+            pair_delay = self.send_delay[self.pair_a]
+            big_m_pos = self._get_big_m(first=self.pair_b, second=self.pair_a)
+            big_m_neg = self._get_big_m(first=self.pair_a, second=self.pair_b)
+            self.model.addConstr(self.send_time[self.pair_a] - self.send_time[self.pair_b]
+                + big_m_pos*self.order_bool - big_m_pos*self.send_bool2 >= pair_delay - big_m_pos, name="overlap_pos")
+            self.model.addConstr(self.send_time[self.pair_b] - self.send_time[self.pair_a]
+                - big_m_neg*self.order_bool - big_m_neg*self.send_bool2 >= pair_delay - 2*big_m_neg, name="overlap_neg")
+
+    def _get_big_m(self, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """
+        Big-M values that relax send_time[second]-send_time[first] >= delay when the order is the other way around
+        or either send is unused. They are derived from the bounds of the send times, i.e., the send windows with
+        upper_bound and [earliest send, big_num] otherwise.
+
+        :param first: indices of the sends meant to go first
+        :param second: indices of the sends meant to go second, on the same links
+        :return: M of each pair
+        """
+        return np.maximum(self.send_delay[first] + self.latest_send[first] - self.earliest_send[second], 0.)
+
+    def _set_start(self, events: List[Event]) -> None:
+        """
+        Load a schedule as the MIP start.
+
+        :param events: (link, chunk, send time, receive time) events of a feasible schedule
+        """
+        send_index = {(edge, chunk): send for send, (edge, chunk) in enumerate(zip(self.send_edge.tolist(), self.send_chunk.tolist()))}
+        used = np.zeros(len(self.send_edge))
+        send_time = self.earliest_send.copy()
+        receive_time = np.full(len(self.nodes)*len(self.chunk_list), GRB.UNDEFINED)
+        receive_time[self._node_chunk_keys(self.collective.precondition)] = 0.
+        for edge, chunk, event_send_time, event_receive_time in events:
+            send = send_index.get((self.compiled.edge_index[edge], self.chunk_index[chunk]))
+            if send is not None:
+                used[send] = 1
+                send_time[send] = event_send_time
+                receive_time[self.send_dest_key[send]] = event_receive_time
+        both_used = (used[self.pair_a] == 1) & (used[self.pair_b] == 1)
+
+        self.total_time.Start = max((event_receive_time for _, _, _, event_receive_time in events), default=0.)
+        self.receive_time.Start = receive_time
+        self.send_bool.Start = used
+        self.send_time.Start = send_time
+        self.send_bool2.Start = both_used.astype(np.float64)
+        self.order_bool.Start = (both_used & (send_time[self.pair_a] < send_time[self.pair_b])).astype(np.float64)
 
     def solve(self, time_limit: float = None, verbose: bool = False, filename: str = None) -> None:
         if time_limit is not None:
@@ -74,15 +218,41 @@ class ILPSynthesizer:
             self.model.optimize()
         except:
             raise Exception("Gurobi cannot solve this ILP!")
+        if self.model.Status in (GRB.INFEASIBLE, GRB.INF_OR_UNBD):
+            raise ValueError(f"No schedule finishes by the upper bound {self.upper_bound}")
+        if self.model.SolCount == 0:
+            raise ValueError(f"Gurobi stopped without a schedule (status {self.model.Status}), e.g., the time limit ran out first")
+        # Gurobi only enforces feasibility up to its tolerances on the scaled model, so check the schedule itself too
+        tolerance = self.model.Params.FeasibilityTol*max(1., self.total_time.X)
+        if self.model.ConstrVio > tolerance:
+            raise ValueError(f"Gurobi returned a solution that violates its constraints by {self.model.ConstrVio}")
+        violations = find_violations(self._edge_to_chunks(), self.compiled, self.collective)
+        if len(violations) > 0:
+            raise ValueError(f"Gurobi returned an invalid schedule with {len(violations)} violation(s):\n" + "\n".join(violations))
 
     def write(self, filename: str) -> None:
         self.model.write(filename)
-    
+
     @property
     def current_time(self):
-        return self.model.getVarByName('T').X
-    
+        return self.total_time.X
+
+    def _edge_to_chunks(self) -> Dict[LinkId, List[Tuple[ChunkId,Time,Time]]]:
+        """
+        :return: transmissions (chunk, send time, receive time) of every link in the solution
+        """
+        # one bulk read per variable array
+        used = self.send_bool.X > 0.5
+        send_time = self.send_time.X
+        receive_time = self.receive_time.X
+        edge_to_chunks = defaultdict(list)
+        for send in np.flatnonzero(used).tolist():
+            edge_to_chunks[self.compiled.edge_list[self.send_edge[send]]].append((self.chunk_list[self.send_chunk[send]], float(send_time[send]), float(receive_time[self.send_dest_key[send]])))
+        return edge_to_chunks
+
     def write_csv(self, filename: str, synthesis_time: float) -> None:
+        edge_to_chunks = self._edge_to_chunks()
+
         with open(filename, mode="w", newline="") as f:
             writer = csv.writer(f)
             writer.writerow(["NPUs Count",len(self.nodes)])
@@ -93,10 +263,4 @@ class ILPSynthesizer:
             writer.writerow(["Synthesis Time",synthesis_time,"s"])
             writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
             for src, dest in self.edges:
-                chunks = []
-                for chunk in self.chunks:
-                    if self.model.getVarByName(f"used[{src},{dest},{chunk}]").X == 1:
-                        send_time = self.model.getVarByName(f"send[{src},{dest},{chunk}]").X
-                        receive_time = self.model.getVarByName(f"receive[{dest},{chunk}]").X
-                        chunks.append((chunk,send_time,receive_time))
-                writer.writerow([src,dest,self.edges[(src,dest)]["alpha"],self.edges[(src,dest)]["beta"]]+[":".join(str(y) for y in x) for x in chunks])
\ No newline at end of file
+                writer.writerow([src,dest,self.edges[(src,dest)]["alpha"],self.edges[(src,dest)]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[(src,dest)]])
@@ -0,0 +1,49 @@
+import bisect
+from helper.typing import *
+from topology.compiled_topology import CompiledTopology
+
+class LinkSchedule:
+    """
+    Busy intervals of every link, for list scheduling transmissions into the earliest gap that fits them.
+    """
+    def __init__(self, compiled: CompiledTopology):
+        self.compiled = compiled
+        # [send time, receive time) intervals of each link, sorted and disjoint
+        self.starts: List[List[Time]] = [[] for _ in range(compiled.num_edges)]
+        self.ends: List[List[Time]] = [[] for _ in range(compiled.num_edges)]
+
+    def earliest_start(self, edge: int, ready: Time) -> Tuple[Time,int]:
+        """
+        :param edge: link index
+        :param ready: earliest send time
+        :return: earliest send time from ready at which the link is free for its delay, and the position of that interval
+        """
+        starts, ends = self.starts[edge], self.ends[edge]
+        delay = self.compiled.delay[edge]
+        position = bisect.bisect_right(ends, ready)
+        start = ready
+        while position<len(starts) and start+delay>starts[position]:
+            start = max(start, ends[position])
+            position += 1
+        return start, position
+
+    def reserve(self, edge: int, ready: Time) -> Tuple[Time,Time]:
+        """
+        Schedule a transmission over a link at its earliest start.
+
+        :param edge: link index
+        :param ready: earliest send time
+        :return: send time and receive time
+        """
+        start, position = self.earliest_start(edge, ready)
+        receive_time = start+self.compiled.delay[edge]
+        self.starts[edge].insert(position, start)
+        self.ends[edge].insert(position, receive_time)
+        return start, receive_time
+
+    def free_from(self, edge: int) -> Time:
+        """
+        :param edge: link index
+        :return: time at which the last transmission over the link ends
+        """
+        return self.ends[edge][-1] if len(self.ends[edge])>0 else 0
@@ -1,49 +1,98 @@
 import csv
 import random
+import multiprocessing
 import numpy as np
 from collections import defaultdict
-from joblib import Parallel, delayed
 from helper.typing import *
+from helper.deadline import Deadline
 from topology.topology import Topology
 from collective.collective import Collective
 from synthesizer.tacos_synthesizer import TACOSSynthesizer
 
+# best collective time found so far, shared by the worker processes of a MultipleTACOSSynthesizer
+incumbent = None
+deadline = None
+
+def init_tacos_worker(shared_incumbent, shared_deadline: Deadline) -> None:
+    global incumbent, deadline
+    incumbent = shared_incumbent
+    deadline = shared_deadline
+
+def solve_tacos_instance(instance: TACOSSynthesizer) -> Optional[Tuple[Time,List[Event]]]:
+    """
+    Solve an instance, aborting once its current_time reaches the incumbent, or once the deadline
+    has expired and an incumbent exists, and publish its collective time. An instance that is running
+    when the deadline expires without an incumbent is finished by SynthesisState.complete().
+
+    :param instance: instance to solve
+    :return: collective time and event history, or None if the instance was aborted
+    """
+    while not instance.satisfied():
+        if instance.current_time>=incumbent.value:
+            return None
+        if deadline.expired():
+            if incumbent.value<float("inf"):
+                return None
+            instance.state.complete()
+            break
+        instance.solve_time_point()
+    with incumbent.get_lock():
+        incumbent.value = min(incumbent.value, instance.current_time)
+    return instance.current_time, instance.event_history
+
 class MultipleTACOSSynthesizer:
-    def __init__(self, topology: Topology, collective: Collective, discretize=False, num_beams=1, seed=None):
+    def __init__(self, topology: Topology, collective: Collective, discretize=False, num_beams=1, batched=False, workers=1, seed=None):
         self.rng = random.Random(seed)
+        self.workers = workers
         seeds = [self.rng.randint(0,2**32-1) for _ in range(num_beams)]
         self.instances = [
-            TACOSSynthesizer(topology=topology, collective=collective, discretize=discretize, seed=seeds[i]) for i in range(num_beams)
+            TACOSSynthesizer(topology=topology, collective=collective, discretize=discretize, batched=batched, seed=seeds[i]) for i in range(num_beams)
         ]
+        # (collective time, event history) of each instance, None if it was aborted by the incumbent
+        self.solutions: List[Optional[Tuple[Time,List[Event]]]] = []
     
-    def solve(self) -> None:
-        # Parallel(n_jobs=-1)(delayed(instance.solve)() for instance in self.instances)
-        for i in range(len(self.instances)):
-            self.instances[i].solve()
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Solve the instances, keeping the best complete schedule.
+        Once time_budget seconds have passed, every instance stops as soon as one complete schedule exists,
+        and the instances running without one are finished cheaply.
+
+        :param time_budget: wall clock budget in seconds (None for no budget)
+        """
+        # branch and bound: an instance whose current_time reaches the best collective time found so far cannot improve on it
+        shared_incumbent = multiprocessing.Value("d", float("inf"))
+        shared_deadline = Deadline(time_budget)
+        if self.workers>1:
+            with multiprocessing.Pool(processes=self.workers, initializer=init_tacos_worker, initargs=(shared_incumbent, shared_deadline)) as pool:
+                self.solutions = pool.map(solve_tacos_instance, self.instances, chunksize=1)
+        else:
+            init_tacos_worker(shared_incumbent, shared_deadline)
+            self.solutions = [solve_tacos_instance(instance) for instance in self.instances]
 
     @property
     def current_time(self):
-        return np.min([instance.current_time for instance in self.instances])
+        return np.min([solution[0] for solution in self.solutions if solution is not None])
     
     def write_csv(self, filename: str, synthesis_time: float) -> None:
-        solve_times = [instance.current_time for instance in self.instances]
+        solve_times = [solution[0] if solution is not None else float("inf") for solution in self.solutions]
         print(solve_times)
-        best_instance = self.instances[np.argmin(solve_times)]
+        instance = self.instances[0]
+        collective_time, event_history = self.solutions[int(np.argmin(solve_times))]
 
         edge_to_chunks = defaultdict(list)
-        for edge,chunk,send_time,receive_time in best_instance.event_history:
+        for edge,chunk,send_time,receive_time in event_history:
             edge_to_chunks[edge].append((chunk, send_time, receive_time))
 
         with open(filename, mode="w", newline="") as f:
             writer = csv.writer(f)
-            writer.writerow(["NPUs Count",len(best_instance.nodes)])
-            writer.writerow(["Links Count",len(best_instance.edges)])
-            writer.writerow(["Chunks Count",len(best_instance.chunks)])
-            writer.writerow(["Chunk Size",best_instance.chunk_size])
-            writer.writerow(["Collective Time",best_instance.current_time,"ns"])
+            writer.writerow(["NPUs Count",len(instance.nodes)])
+            writer.writerow(["Links Count",len(instance.edges)])
+            writer.writerow(["Chunks Count",len(instance.chunks)])
+            writer.writerow(["Chunk Size",instance.chunk_size])
+            writer.writerow(["Collective Time",collective_time,"ns"])
             writer.writerow(["Synthesis Time",synthesis_time,"s"])
             writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
-            for edge in best_instance.edges:
+            for edge in instance.edges:
                 src, dest = edge
-                writer.writerow([src,dest,best_instance.edges[edge]["alpha"],best_instance.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
+                writer.writerow([src,dest,instance.edges[edge]["alpha"],instance.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
     
\ No newline at end of file
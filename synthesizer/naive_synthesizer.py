@@ -2,9 +2,12 @@ import csv
 import random
 from collections import defaultdict
 from helper.typing import *
+from helper.deadline import Deadline
 from helper.event_queue import EventQueue
 from topology.topology import Topology
+from topology.time_expanded_network import TimeExpandedNetwork
 from collective.collective import Collective
+from synthesizer.synthesis_state import SynthesisState
 
 class NaiveSynthesizer:
     def __init__(self, topology: Topology, collective: Collective, discretize=False, seed=None):
@@ -18,77 +21,73 @@ class NaiveSynthesizer:
         self.edges = self.topology.G.edges
         self.chunks = self.collective.chunks
 
+        self.ten = None
         if discretize:
             self.discretize()
 
-        self.current_time = 0
-        self.event_history: List[Event] = []
         self.event_queue = EventQueue()
 
-        self.link_busy_until = {edge:0 for edge in self.topology.G.edges}
-        self.chunk_arrival_at_node = {node:defaultdict(lambda:float('inf')) for node in self.topology.G.nodes}
-        for chunk, node in self.collective.precondition:
-            self.chunk_arrival_at_node[node][chunk] = 0
+        self.state = SynthesisState(topology=self.topology, collective=self.collective, receiver_driven=False, ten=self.ten)
+
+    @property
+    def current_time(self) -> Time:
+        return self.state.current_time
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.state.event_history
     
     def satisfied(self) -> bool:
-        for chunk, node in self.collective.postcondition:
-            if self.chunk_arrival_at_node[node][chunk]>self.current_time:
-                return False
-        return True
+        return self.state.satisfied()
 
     def get_available_links(self) -> List[LinkId]:
-        return [edge for edge,busy_until in self.link_busy_until.items() if busy_until<=self.current_time]
+        return [self.state.edge_list[edge] for edge in self.state.get_available_links()]
 
     def get_chunks_at_node(self, node: NpuId) -> List[ChunkId]:
-        return [chunk for chunk, arrival_time in self.chunk_arrival_at_node[node].items() if arrival_time<=self.current_time]
+        return [self.state.chunk_list[chunk] for chunk in self.state.get_chunks_at_node(self.state.node_index[node], self.current_time)]
 
     def is_productive_link_chunk_match(self, edge: LinkId, chunk: ChunkId) -> bool:
-        src, dest = edge
-        return (
-            self.link_busy_until[edge]<=self.current_time and # available
-            self.chunk_arrival_at_node[src][chunk]<=self.current_time and # chunk is available at source
-            self.chunk_arrival_at_node[dest][chunk]==float('inf') and # dest does not have it AND not enroute
-            (chunk, dest) in self.collective.postcondition # chunk is needed at dest
-        )
+        return self.state.is_productive_link_chunk_match(edge=self.state.edge_index[edge], chunk=self.state.chunk_index[chunk])
 
     def get_possible_link_chunk_matches(self) -> List[Tuple[LinkId,ChunkId]]:
-        matches = []
-        available_links = self.get_available_links()
-        for src, dest in available_links:
-            for chunk in self.get_chunks_at_node(src):
-                if self.is_productive_link_chunk_match(edge=(src, dest), chunk=chunk):
-                    matches.append(((src, dest), chunk))
-        return matches
+        edges, chunks = self.state.get_possible_link_chunk_matches()
+        return [(self.state.edge_list[edge], self.state.chunk_list[chunk]) for edge, chunk in zip(edges, chunks)]
 
     def match(self, edge: LinkId, chunk: ChunkId) -> None:
-        src, dest = edge
-        if not self.is_productive_link_chunk_match(edge=edge, chunk=chunk):
-            raise ValueError(f"Attempted invalid link chunk match: {edge}, {chunk}")
-        send_time = self.current_time
-        receive_time = self.current_time + self.topology.get_delay(edge=edge, chunk_size=self.chunk_size)
-        self.event_history.append((edge,chunk,send_time,receive_time))
-        self.link_busy_until[edge] = receive_time
-        self.chunk_arrival_at_node[dest][chunk] = receive_time
-        self.event_queue.push((edge,chunk,send_time,receive_time))
+        event = self.state.match(edge=self.state.edge_index[edge], chunk=self.state.chunk_index[chunk])
+        self.event_queue.push(event)
 
     def step(self) -> None:
         next_time, events = self.event_queue.pop()
-        self.current_time = next_time
+        self.state.advance(next_time)
 
-    def discretize(self) -> None:
-        pass
+    def discretize(self, timestep: Optional[Time] = None) -> None:
+        self.ten = TimeExpandedNetwork(self.topology.compile(self.chunk_size), timestep=timestep)
 
     def write_ten(self, filename: str) -> None:
-        pass
+        if self.ten is None:
+            raise ValueError("write_ten() requires a discretized synthesizer")
+        self.ten.write_ten(filename, self.event_history)
     
-    def solve(self) -> None:
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Run the rollout until the postcondition is satisfied.
+        Once time_budget seconds have passed, the rest of the schedule is finished by SynthesisState.complete().
+        The budget is a soft limit: it is checked between time points and the completion runs after it,
+        and the completed schedule is not tuned, so its collective time can be up to about twice as long.
+
+        :param time_budget: soft wall clock budget in seconds (None for no budget)
+        """
+        deadline = Deadline(time_budget)
         while not self.satisfied():
-            possible_matches = self.get_possible_link_chunk_matches()
-            if len(possible_matches)==0:
+            if deadline.expired():
+                self.state.complete()
+                break
+            if len(self.state.candidates)==0:
                 self.step()
             else:
-                chosen_edge, chosen_chunk = self.rng.choice(possible_matches)
-                self.match(edge=chosen_edge, chunk=chosen_chunk)
+                chosen_edge, chosen_chunk = self.state.sample_candidate(self.rng)
+                self.event_queue.push(self.state.match(edge=chosen_edge, chunk=chosen_chunk))
     
     def write_csv(self, filename: str, synthesis_time: float) -> None:
         edge_to_chunks = defaultdict(list)
@@ -0,0 +1,140 @@
+import csv
+from collections import defaultdict
+from helper.typing import *
+from helper.deadline import Deadline
+from topology.topology import Topology
+from collective.collective import Collective
+from synthesizer.tacos_synthesizer import TACOSSynthesizer
+from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
+from synthesizer.symmetric_synthesizer import SymmetricSynthesizer
+from synthesizer.link_schedule import LinkSchedule
+
+class PipelinedSynthesizer:
+    """
+    Synthesis of a collective with collectives_count > 1 from the schedule of a single instance.
+
+    The chunks of the collective are split into collectives_count instances of consecutive chunk ids, and every
+    instance must be the first one with shifted chunk ids (as built by the collectives with collectives_count).
+    Only the first instance is synthesized, once per variant with a different seed. Instance r copies the schedule
+    of variant r % variants shifted by r intervals, and link conflicts are resolved by list scheduling: in shifted
+    send order, each transmission takes the earliest gap on its link after its src holds the chunk. Variants spread
+    the copies over different links where one schedule of the instance concentrates its load.
+    """
+    def __init__(self, topology: Topology, collective: Collective, collectives_count: int, synthesizer="tacos", interval: Optional[Time] = None, variants: int = 1, batched=False, seed=None):
+        """
+        :param topology: topology
+        :param collective: collective of collectives_count instances
+        :param collectives_count: number of instances
+        :param synthesizer: synthesizer of the first instance (tacos, greedy_tacos, symmetric)
+        :param interval: shift in ns between consecutive instances (default: busy time of the busiest link in one instance)
+        :param variants: number of schedules of the first instance, synthesized with seeds seed, seed+1, ...
+        :param batched: match all free links at each time point in one pass (tacos, greedy_tacos)
+        :param seed: seed of the synthesizer
+        """
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+        self.collectives_count = collectives_count
+        self.interval = interval
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        self.compiled = self.topology.compile(self.chunk_size)
+        self.chunk_list: List[ChunkId] = sorted(self.chunks)
+        if collectives_count<1 or len(self.chunk_list)%collectives_count!=0:
+            raise ValueError(f"Cannot split {len(self.chunk_list)} chunks into {collectives_count} instances")
+        self.instance_size = len(self.chunk_list)//collectives_count
+        # position in its instance and instance of every chunk
+        self.chunk_position: Dict[ChunkId, Tuple[int,int]] = {chunk: (i%self.instance_size, i//self.instance_size) for i, chunk in enumerate(self.chunk_list)}
+
+        preconditions, postconditions = defaultdict(set), defaultdict(set)
+        for chunk, node in self.collective.precondition:
+            preconditions[self.chunk_position[chunk]].add(node)
+        for chunk, node in self.collective.postcondition:
+            postconditions[self.chunk_position[chunk]].add(node)
+        for (position, instance) in list(preconditions)+list(postconditions):
+            if preconditions[position, instance]!=preconditions[position, 0] or postconditions[position, instance]!=postconditions[position, 0]:
+                raise ValueError(f"Instance {instance} is not a copy of the first instance: chunk {self.chunk_list[instance*self.instance_size+position]} differs")
+
+        self.instance = Collective(chunk_size=self.chunk_size)
+        for position in range(self.instance_size):
+            chunk = self.chunk_list[position]
+            holders, destinations = sorted(preconditions[position, 0]), sorted(postconditions[position, 0])
+            for dest in destinations:
+                self.instance.add(id=chunk, src=holders[0], dest=dest)
+            for holder in holders[1:]:
+                self.instance.add(id=chunk, src=holder, dest=destinations[0])
+        self.instance.chunks_count = len(self.instance.chunks)
+
+        if synthesizer not in ("tacos", "greedy_tacos", "symmetric"):
+            raise ValueError(f"Instance synthesizer not supported: {synthesizer}")
+        if variants<1:
+            raise ValueError(f"Number of variants must be positive: {variants}")
+        self.synthesizers = []
+        for variant in range(variants):
+            variant_seed = seed+variant if seed is not None else None
+            if synthesizer=="tacos":
+                self.synthesizers.append(TACOSSynthesizer(topology=self.topology, collective=self.instance, batched=batched, seed=variant_seed))
+            elif synthesizer=="greedy_tacos":
+                # greedy TACOS is deterministic, so its variants would all be the same
+                self.synthesizers.append(GreedyTACOSSynthesizer(topology=self.topology, collective=self.instance, batched=batched))
+                break
+            elif synthesizer=="symmetric":
+                self.synthesizers.append(SymmetricSynthesizer(topology=self.topology, collective=self.instance, seed=variant_seed))
+
+        self.events: List[Event] = []
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        # the variants share the budget: each one gets what is left when it starts, and the variants that would start
+        # after it has passed are dropped, as the first one is enough to pipeline the instances
+        deadline = Deadline(time_budget)
+        variant_events = []
+        for synthesizer in self.synthesizers:
+            if len(variant_events)>0 and deadline.expired():
+                break
+            synthesizer.solve(time_budget=deadline.remaining())
+            variant_events.append(sorted(synthesizer.event_history, key=lambda event: event[2]))
+        if self.interval is None:
+            busy_time = defaultdict(float)
+            for edge, _, send_time, receive_time in variant_events[0]:
+                busy_time[edge] += receive_time-send_time
+            self.interval = max(busy_time.values(), default=0)
+
+        link_schedule = LinkSchedule(self.compiled)
+        arrival: Dict[Tuple[ChunkId,NpuId],Time] = {(chunk, node): 0 for chunk, node in self.collective.precondition}
+        # shifted send order, in which every transmission comes after the one that brings its chunk to its src
+        shifted = sorted(((send_time+instance*self.interval, instance, i) for instance in range(self.collectives_count) for i, (_, _, send_time, _) in enumerate(variant_events[instance%len(variant_events)])))
+        for _, instance, i in shifted:
+            (src, dest), chunk, _, _ = variant_events[instance%len(variant_events)][i]
+            chunk = self.chunk_list[instance*self.instance_size+self.chunk_position[chunk][0]]
+            start, receive_time = link_schedule.reserve(self.compiled.edge_index[src, dest], arrival[chunk, src])
+            arrival[chunk, dest] = min(arrival.get((chunk, dest), receive_time), receive_time)
+            self.events.append(((src, dest), chunk, start, receive_time))
+
+    @property
+    def current_time(self) -> Time:
+        return max((receive_time for _, _, _, receive_time in self.events), default=0)
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.events
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        edge_to_chunks = defaultdict(list)
+        for edge,chunk,send_time,receive_time in self.event_history:
+            edge_to_chunks[edge].append((chunk, send_time, receive_time))
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
@@ -0,0 +1,118 @@
+import csv
+from collections import defaultdict
+from helper.typing import *
+from topology.topology import Topology
+from collective.collective import Collective
+from synthesizer.tacos_synthesizer import TACOSSynthesizer
+from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
+
+class RepairSynthesizer:
+    """
+    Repair a schedule after links fail or change their alpha/beta at event_time, without synthesizing from time 0.
+
+    Transmissions that are received by event_time are kept, and so are those in flight over unaffected links.
+    Transmissions in flight over affected links are lost, and those not sent yet are dropped. The rest of the
+    collective is synthesized on the topology after the event from the reconstructed state: every NPU holds the
+    chunks it received (from the time they arrive), links are free from event_time or once their kept transmission
+    ends, and only the postconditions that are not met yet remain.
+    """
+    def __init__(self, topology: Topology, collective: Collective, schedule: List[Event], event_time: Time, removed_links: Optional[Set[LinkId]] = None, changed_links: Optional[Dict[LinkId,LinkAlphaBeta]] = None, synthesizer="tacos", batched=False, seed=None):
+        """
+        :param topology: topology before the event
+        :param collective: collective
+        :param schedule: transmissions of the collective as (link, chunk, send time, receive time)
+        :param event_time: time of the failure or change
+        :param removed_links: links that fail at event_time
+        :param changed_links: new alpha and beta of the links that change at event_time
+        :param synthesizer: synthesizer of the rest of the collective (tacos, greedy_tacos)
+        :param batched: match all free links at each time point in one pass (tacos, greedy_tacos)
+        :param seed: seed of the synthesizer
+        """
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+        self.event_time = event_time
+        removed_links = set(removed_links) if removed_links is not None else set()
+        changed_links = dict(changed_links) if changed_links is not None else {}
+        unknown = (removed_links | set(changed_links)) - set(self.topology.G.edges)
+        if len(unknown)>0:
+            raise ValueError(f"Links are not in the topology: {unknown}")
+        self.affected_links: Set[LinkId] = removed_links | set(changed_links)
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        # topology after the event
+        G = self.topology.G.copy()
+        G.remove_edges_from(removed_links)
+        for (src, dest), (alpha, beta) in changed_links.items():
+            G.add_edge(src, dest, alpha=alpha, beta=beta)
+        self.repaired_topology = Topology(G=G)
+        self.compiled = self.repaired_topology.compile(self.chunk_size)
+
+        self.kept_events: List[Event] = []
+        arrival: Dict[Tuple[ChunkId,NpuId],Time] = {(chunk, node): 0 for chunk, node in self.collective.precondition}
+        link_available_from = {edge: event_time for edge in self.compiled.edge_list}
+        for edge, chunk, send_time, receive_time in sorted(schedule, key=lambda event: event[2]):
+            if receive_time<=event_time or (send_time<event_time and edge not in self.affected_links):
+                self.kept_events.append((edge, chunk, send_time, receive_time))
+                arrival[chunk, edge[1]] = min(arrival.get((chunk, edge[1]), receive_time), receive_time)
+                if edge in link_available_from:
+                    link_available_from[edge] = max(link_available_from[edge], receive_time)
+
+        # the rest of the collective: every holder of a chunk is a precondition of it, and every unmet postcondition remains
+        holders, destinations = defaultdict(list), defaultdict(list)
+        for (chunk, node) in sorted(arrival):
+            holders[chunk].append(node)
+        for chunk, node in sorted(self.collective.postcondition):
+            if (chunk, node) not in arrival:
+                destinations[chunk].append(node)
+        self.remaining = Collective(chunk_size=self.chunk_size)
+        for chunk in sorted(destinations):
+            for dest in destinations[chunk]:
+                self.remaining.add(id=chunk, src=holders[chunk][0], dest=dest)
+            for holder in holders[chunk][1:]:
+                self.remaining.add(id=chunk, src=holder, dest=destinations[chunk][0])
+        self.remaining.chunks_count = len(self.remaining.chunks)
+
+        self.synthesizer = None
+        if len(self.remaining.chunks)>0:
+            precondition_time = {(chunk, node): arrival[chunk, node] for chunk, node in self.remaining.precondition}
+            if synthesizer=="tacos":
+                self.synthesizer = TACOSSynthesizer(topology=self.repaired_topology, collective=self.remaining, batched=batched, seed=seed, precondition_time=precondition_time, link_available_from=link_available_from)
+            elif synthesizer=="greedy_tacos":
+                self.synthesizer = GreedyTACOSSynthesizer(topology=self.repaired_topology, collective=self.remaining, batched=batched, precondition_time=precondition_time, link_available_from=link_available_from)
+            else:
+                raise ValueError(f"Synthesizer not supported: {synthesizer}")
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        if self.synthesizer is not None:
+            self.synthesizer.solve(time_budget=time_budget)
+
+    @property
+    def current_time(self) -> Time:
+        return max((receive_time for _, _, _, receive_time in self.event_history), default=0)
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.kept_events+(list(self.synthesizer.event_history) if self.synthesizer is not None else [])
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        # links keep their alpha and beta from before the event, as the kept transmissions over them may predate it
+        edge_to_chunks = defaultdict(list)
+        for edge,chunk,send_time,receive_time in self.event_history:
+            edge_to_chunks[edge].append((chunk, send_time, receive_time))
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
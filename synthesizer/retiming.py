@@ -0,0 +1,137 @@
+import csv
+from collections import defaultdict
+from helper.typing import *
+from topology.topology import Topology
+from collective.collective import Collective
+from synthesizer.tacos_synthesizer import TACOSSynthesizer
+from synthesizer.greedy_tacos_synthesizer import GreedyTACOSSynthesizer
+
+
+def read_schedule(filename: str) -> List[Event]:
+    """
+    Read the transmissions of a result csv (as written by write_csv()).
+
+    :param filename: result csv
+    :return: transmissions as (link, chunk, send time, receive time)
+    """
+    events = []
+    with open(filename, mode="r", newline="") as f:
+        reader = csv.reader(f)
+        for i, row in enumerate(reader):
+            if i==6 and row!=["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"]:
+                raise ValueError(f"Expected 'SrcID,DestID,Latency (ns),Bandwidth (GB/s),Chunks (ID:ns:ns)' but got {row}")
+            elif i>=7:
+                edge = (int(row[0]), int(row[1]))
+                for transmission in row[4:]:
+                    chunk, send_time, receive_time = transmission.split(":")
+                    events.append((edge, int(chunk), float(send_time), float(receive_time)))
+    return events
+
+
+class RetimingSynthesizer:
+    """
+    Recompute the times of an existing schedule for new link delays (e.g., another chunk size or alpha/beta).
+
+    Every transmission keeps its link, chunk, and position in the order of its link, and is sent as soon as its link
+    is done with the previous transmission and its src holds the chunk, i.e., received it over any link (or had it
+    from the start). Transmissions are retimed in their original send order, which is a topological order of these
+    dependencies as every link delay is positive, so one pass suffices.
+
+    If a threshold is given and the retimed schedule takes more than (1+threshold) times the original collective
+    time scaled by the change in link delays, the collective is synthesized again and the shorter schedule is kept.
+    """
+    def __init__(self, topology: Topology, collective: Collective, schedule: List[Event], threshold: Optional[float] = None, synthesizer="tacos", batched=False, seed=None):
+        """
+        :param topology: topology with the new alpha and beta of the links
+        :param collective: collective with the new chunk size
+        :param schedule: transmissions of the collective as (link, chunk, send time, receive time), e.g., the
+                         event_history of a synthesizer or read_schedule() of a result csv
+        :param threshold: largest relative slowdown of the retimed schedule before synthesizing again (default: never)
+        :param synthesizer: synthesizer used to synthesize again (tacos, greedy_tacos)
+        :param batched: match all free links at each time point in one pass (tacos, greedy_tacos)
+        :param seed: seed of the synthesizer
+        """
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+        self.schedule = sorted(schedule, key=lambda event: event[2])
+        self.threshold = threshold
+        self.synthesizer_name = synthesizer
+        self.batched = batched
+        self.seed = seed
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        self.compiled = self.topology.compile(self.chunk_size)
+        missing = {edge for edge, _, _, _ in self.schedule if edge not in self.compiled.edge_index}
+        if len(missing)>0:
+            raise ValueError(f"Schedule uses links that are not in the topology: {missing}")
+        if synthesizer not in ("tacos", "greedy_tacos"):
+            raise ValueError(f"Synthesizer not supported: {synthesizer}")
+
+        self.events: List[Event] = []
+        self.resynthesized = False
+
+    def retime(self) -> List[Event]:
+        """
+        :return: retimed transmissions, in their original send order
+        """
+        delay = self.compiled.delay
+        arrival: Dict[Tuple[ChunkId,NpuId],Time] = {(chunk, node): 0 for chunk, node in self.collective.precondition}
+        link_free = defaultdict(float)
+        events = []
+        for (src, dest), chunk, _, _ in self.schedule:
+            if (chunk, src) not in arrival:
+                raise ValueError(f"Link {(src, dest)} sends chunk {chunk} before its src receives it")
+            send_time = max(link_free[src, dest], arrival[chunk, src])
+            receive_time = send_time+delay[self.compiled.edge_index[src, dest]]
+            link_free[src, dest] = receive_time
+            arrival[chunk, dest] = min(arrival.get((chunk, dest), receive_time), receive_time)
+            events.append(((src, dest), chunk, send_time, receive_time))
+        return events
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        self.events = self.retime()
+        if self.threshold is None or len(self.schedule)==0:
+            return
+        # the original collective time scaled by the change in the total busy time of the links
+        old_busy = sum(receive_time-send_time for _, _, send_time, receive_time in self.schedule)
+        new_busy = sum(receive_time-send_time for _, _, send_time, receive_time in self.events)
+        reference = max(receive_time for _, _, _, receive_time in self.schedule)*new_busy/old_busy
+        if self.current_time>(1+self.threshold)*reference:
+            if self.synthesizer_name=="tacos":
+                synthesizer = TACOSSynthesizer(topology=self.topology, collective=self.collective, batched=self.batched, seed=self.seed)
+            else:
+                synthesizer = GreedyTACOSSynthesizer(topology=self.topology, collective=self.collective, batched=self.batched)
+            synthesizer.solve(time_budget=time_budget)
+            if synthesizer.current_time<self.current_time:
+                self.events = list(synthesizer.event_history)
+                self.resynthesized = True
+
+    @property
+    def current_time(self) -> Time:
+        return max((receive_time for _, _, _, receive_time in self.events), default=0)
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.events
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        edge_to_chunks = defaultdict(list)
+        for edge,chunk,send_time,receive_time in self.event_history:
+            edge_to_chunks[edge].append((chunk, send_time, receive_time))
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
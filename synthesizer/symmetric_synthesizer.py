@@ -0,0 +1,185 @@
+import csv
+import numpy as np
+from collections import defaultdict
+from helper.typing import *
+from helper.deadline import Deadline
+from topology.topology import Topology
+from topology.automorphism import regular_automorphism_group
+from collective.collective import Collective
+from synthesizer.synthesis_state import earliest_arrival_routes
+
+class SymmetricSynthesizer:
+    """
+    Synthesis for collectives that the automorphisms of a vertex-transitive topology map onto themselves
+    (e.g., All-Gather on a torus).
+
+    The topology needs a group of automorphisms that maps every NPU to every other NPU in exactly one way (see
+    regular_automorphism_group()), taken from Topology.automorphisms or searched for. Only the chunks of the first
+    NPU are synthesized, and the automorphism that maps it to each other NPU maps them onto that NPU's chunks.
+    The automorphisms map the links of one orbit onto each other, and every link of an orbit carries one replica
+    of every transmission over the orbit, so each orbit is scheduled as a single link to avoid contention.
+    """
+    def __init__(self, topology: Topology, collective: Collective, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        self.compiled = self.topology.compile(self.chunk_size)
+        self.group = regular_automorphism_group(self.topology, self.topology.automorphisms)
+        if self.group is None:
+            raise ValueError("Symmetric synthesis requires a topology with a regular automorphism group (e.g., a torus)")
+        num_nodes = self.compiled.num_nodes
+        # node mapped to node index 0 by the inverse of each automorphism
+        self.inverse_root = np.empty(num_nodes, dtype=np.int64)
+        elements, nodes = np.nonzero(self.group==0)
+        self.inverse_root[elements] = nodes
+
+        # chunks of every NPU, where the j-th chunk of NPU u is the image of the j-th chunk of node index 0
+        sources = defaultdict(list)
+        for chunk, node in self.collective.precondition:
+            sources[chunk].append(self.compiled.node_index[node])
+        if any(len(nodes)!=1 for nodes in sources.values()):
+            raise ValueError("Symmetric synthesis requires every chunk to start at exactly one NPU")
+        chunks_at_node = [[] for _ in range(num_nodes)]
+        for chunk, (node,) in sorted(sources.items()):
+            chunks_at_node[node].append(chunk)
+        if any(len(chunks)!=len(chunks_at_node[0]) for chunks in chunks_at_node):
+            raise ValueError("Symmetric synthesis requires every NPU to start with the same number of chunks")
+        self.chunks_at_node = np.array(chunks_at_node, dtype=np.int64).reshape(num_nodes, -1)
+        destinations = defaultdict(list)
+        for chunk, node in self.collective.postcondition:
+            destinations[chunk].append(self.compiled.node_index[node])
+        self.needed = np.zeros((num_nodes, self.chunks_at_node.shape[1]), dtype=bool)
+        for j, chunk in enumerate(self.chunks_at_node[0].tolist()):
+            self.needed[destinations[chunk], j] = True
+        for node in range(num_nodes):
+            for j, chunk in enumerate(self.chunks_at_node[node].tolist()):
+                if not np.array_equal(np.sort(destinations[chunk]), np.sort(self.group[node][self.needed[:, j]])):
+                    raise ValueError(f"Collective is not symmetric: chunk {chunk} is not the image of chunk {self.chunks_at_node[0, j]}")
+
+        # orbit of every link, named by the link out of node index 0 it contains
+        root_edges = {dest: edge for edge, (src, dest) in enumerate(zip(self.compiled.src.tolist(), self.compiled.dest.tolist())) if src==0}
+        self.orbit = np.array([root_edges[self.group[self.inverse_root[src], dest]] for src, dest in zip(self.compiled.src.tolist(), self.compiled.dest.tolist())], dtype=np.int64)
+        keys = self.compiled.src*num_nodes+self.compiled.dest
+        self.edge_order = np.argsort(keys)
+        self.sorted_keys = keys[self.edge_order]
+
+        # transmissions of the chunks of node index 0 as (edge, j, send time, receive time)
+        self.events: List[Tuple[int,int,Time,Time]] = []
+
+    def _edges_of(self, srcs: np.ndarray, dests: np.ndarray) -> np.ndarray:
+        """
+        :param srcs: src node indices
+        :param dests: dest node indices
+        :return: edge indices of the links
+        """
+        return self.edge_order[np.searchsorted(self.sorted_keys, srcs*self.compiled.num_nodes+dests)]
+
+    def _complete(self, arrival: np.ndarray, orbit_free: np.ndarray) -> None:
+        """
+        Finish the chunks of node index 0 cheaply: every chunk that is still needed is sent along its earliest-arrival
+        routes (see earliest_arrival_routes()), list-scheduled in earliest-arrival order with one transmission per orbit
+        at a time, so that the replicated schedule stays free of contention.
+
+        :param arrival: (nodes x chunks) arrival times of the chunks of node index 0, updated in place
+        :param orbit_free: time from which each orbit is free, updated in place
+        """
+        src, dest, delay = self.compiled.src, self.compiled.dest, self.compiled.delay
+        edges, chunks = earliest_arrival_routes(arrival, orbit_free[self.orbit], delay, src, dest, self.needed & (arrival==np.inf))
+        for edge, chunk in zip(edges.tolist(), chunks.tolist()):
+            send_time = float(max(arrival[src[edge], chunk], orbit_free[self.orbit[edge]]))
+            receive_time = float(send_time+delay[edge])
+            arrival[dest[edge], chunk] = receive_time
+            orbit_free[self.orbit[edge]] = receive_time
+            self.events.append((edge, chunk, send_time, receive_time))
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Synthesize the transmissions of the chunks of node index 0 and replicate them.
+        Once time_budget seconds have passed, the chunks of node index 0 are finished by _complete().
+        The budget is a soft limit, as for the TACOS rollouts.
+
+        :param time_budget: soft wall clock budget in seconds (None for no budget)
+        """
+        deadline = Deadline(time_budget)
+        src, dest, delay = self.compiled.src, self.compiled.dest, self.compiled.delay
+        arrival = np.full(self.needed.shape, np.inf)
+        arrival[0] = 0
+        orbit_free = np.zeros(self.orbit.max(initial=-1)+1)
+        current_time = 0.
+        while np.any(self.needed & (arrival==np.inf)):
+            if deadline.expired():
+                self._complete(arrival, orbit_free)
+                break
+            # like TACOS, a link is matched with a random chunk that its src holds and its dest needs
+            free = orbit_free[self.orbit]<=current_time
+            edges, chunks = np.nonzero(free[:, None] & (arrival[src]<=current_time) & self.needed[dest] & (arrival[dest]==np.inf))
+            order = self.rng.permutation(len(edges))
+            edges, chunks = edges[order], chunks[order]
+            while len(edges)>0:
+                # the first candidate of every free orbit, unless another one already brings its chunk to its dest
+                _, firsts = np.unique(self.orbit[edges], return_index=True)
+                for edge, chunk in zip(edges[np.sort(firsts)].tolist(), chunks[np.sort(firsts)].tolist()):
+                    if arrival[dest[edge], chunk]==np.inf:
+                        receive_time = float(current_time+delay[edge])
+                        arrival[dest[edge], chunk] = receive_time
+                        orbit_free[self.orbit[edge]] = receive_time
+                        self.events.append((edge, chunk, current_time, receive_time))
+                remaining = (orbit_free[self.orbit[edges]]<=current_time) & (arrival[dest[edges], chunks]==np.inf)
+                edges, chunks = edges[remaining], chunks[remaining]
+            later = np.concatenate([orbit_free[orbit_free>current_time], arrival[(arrival>current_time) & (arrival!=np.inf)]])
+            if len(later)==0:
+                raise ValueError("Synthesis is stuck: some NPUs can only be reached through NPUs that do not need the chunk")
+            current_time = float(later.min())
+
+    @property
+    def current_time(self) -> Time:
+        return max((receive_time for _, _, _, receive_time in self.events), default=0)
+
+    @property
+    def event_history(self) -> List[Event]:
+        """
+        Replicated schedule of all chunks, built on every access.
+        """
+        if len(self.events)==0:
+            return []
+        edges, chunks, send_times, receive_times = (np.array(values) for values in zip(*self.events))
+        event_history = []
+        for node in range(self.compiled.num_nodes):
+            images = self._edges_of(self.group[node][self.compiled.src[edges]], self.group[node][self.compiled.dest[edges]])
+            for edge, chunk, send_time, receive_time in zip(images.tolist(), self.chunks_at_node[node][chunks].tolist(), send_times.tolist(), receive_times.tolist()):
+                event_history.append((self.compiled.edge_list[edge], chunk, send_time, receive_time))
+        return event_history
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        # the transmissions over a link are the images of the transmissions over its orbit
+        orbit_events = defaultdict(list)
+        for edge, chunk, send_time, receive_time in sorted(self.events, key=lambda event: event[2]):
+            orbit_events[self.orbit[edge]].append((edge, chunk, send_time, receive_time))
+        orbit_events = {orbit: tuple(np.array(values) for values in zip(*events)) for orbit, events in orbit_events.items()}
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                transmissions = []
+                index = self.compiled.edge_index[edge]
+                if self.orbit[index] in orbit_events:
+                    edges, chunks, send_times, receive_times = orbit_events[self.orbit[index]]
+                    # the automorphism that maps the src of each orbit link to src
+                    nodes = self.group[self.compiled.src[index]][self.inverse_root[self.compiled.src[edges]]]
+                    transmissions = zip(self.chunks_at_node[nodes, chunks].tolist(), send_times.tolist(), receive_times.tolist())
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in transmissions])
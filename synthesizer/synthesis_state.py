@@ -0,0 +1,434 @@
+import heapq
+import hashlib
+import numpy as np
+from copy import copy
+from helper.typing import *
+from topology.topology import Topology
+from topology.time_expanded_network import TimeExpandedNetwork
+from collective.collective import Collective
+
+
+def earliest_arrival_routes(arrival: np.ndarray, link_free: np.ndarray, duration: np.ndarray, src: np.ndarray, dest: np.ndarray,
+                            targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Earliest-arrival routes of every chunk from the nodes that hold it to the nodes that need it.
+
+    A link that can send a chunk at time t delivers it at max(t, link_free) + duration, which never decreases
+    with t, so relaxing all (link, chunk) pairs at once until no arrival improves finds the earliest arrival
+    of every chunk at every node. The arrivals assume each link is free for every chunk, so they are only a
+    priority: the caller schedules the returned transmissions in this order and delays them where links collide.
+
+    :param arrival: (nodes x chunks) time at which each node holds each chunk (inf if it does not)
+    :param link_free: time from which each link can start a transmission
+    :param duration: time each link is occupied by a transmission
+    :param src: src node index of each link
+    :param dest: dest node index of each link
+    :param targets: (nodes x chunks) mask of the chunks each node needs
+    :return: (link indices, chunk indices) of the transmissions on the routes, in earliest-arrival order
+    """
+    missing = arrival == np.inf
+    arrival = arrival.astype(np.float64)
+    parent = np.full(arrival.shape, -1, dtype=np.int64)
+    # sort the links by dest so that the candidates into each node are reduced in one pass
+    order = np.argsort(dest, kind="stable")
+    order_src, order_dest = src[order], dest[order]
+    receivers, first_edge = np.unique(order_dest, return_index=True)
+    receiver_of_edge = np.searchsorted(receivers, order_dest)
+    link_free, duration = link_free[order, None], duration[order, None]
+    while len(receivers) > 0:
+        candidate = np.maximum(arrival[order_src], link_free) + duration
+        best = np.minimum.reduceat(candidate, first_edge, axis=0)
+        improved = missing[receivers] & (best < arrival[receivers])
+        if not improved.any():
+            break
+        arrival[receivers] = np.where(improved, best, arrival[receivers])
+        edges, chunks = np.nonzero(improved[receiver_of_edge] & (candidate == arrival[order_dest]))
+        parent[order_dest[edges], chunks] = order[edges]
+    unreachable = np.flatnonzero(np.any(targets & (arrival == np.inf), axis=1))
+    if len(unreachable) > 0:
+        raise ValueError(f"No route reaches node indices {unreachable.tolist()}, so the postcondition cannot be satisfied")
+    # walk back from the targets; routes of a chunk form a tree, so each link is kept at most once per chunk
+    used = np.zeros((len(src), arrival.shape[1]), dtype=bool)
+    nodes, chunks = np.nonzero(targets & missing)
+    while len(nodes) > 0:
+        edges = parent[nodes, chunks]
+        new = edges >= 0
+        edges, chunks = edges[new], chunks[new]
+        new = ~used[edges, chunks]
+        edges, chunks = edges[new], chunks[new]
+        used[edges, chunks] = True
+        nodes = src[edges]
+    edges, chunks = np.nonzero(used)
+    by_arrival = np.lexsort((edges, arrival[dest[edges], chunks]))
+    return edges[by_arrival], chunks[by_arrival]
+
+
+class SynthesisState:
+    """
+    Array-backed synthesis state shared by the TACOS-family synthesizers.
+
+    Chunk arrival times are stored as a dense (nodes x chunks) matrix and link availability
+    as an edge-indexed array. Nodes, links, and chunks are addressed by their position in
+    node_list, edge_list, and chunk_list respectively.
+
+    Productive (link, chunk) matches are kept in an incrementally maintained candidate index:
+    match() and advance() only touch the links incident to the nodes and links they change.
+
+    copy() forks the state without copying the topology, collective, or event history:
+    the arrays and per-link ready sets are copied on first write and the event history is
+    a persistent linked list shared with the parent.
+    """
+
+    def __init__(self, topology: Topology, collective: Collective, receiver_driven: bool = True, ten: Optional[TimeExpandedNetwork] = None,
+                 precondition_time: Optional[Dict[Tuple[ChunkId,NpuId],Time]] = None, link_available_from: Optional[Dict[LinkId,Time]] = None):
+        """
+        Initialize the state at time 0 with only the preconditions satisfied.
+
+        :param topology: target topology
+        :param collective: collective to synthesize
+        :param receiver_driven: if True, a match at current_time is a transmission that is received at current_time
+                                (TACOS); otherwise it is a transmission that is sent at current_time (Naive)
+        :param ten: if given, links are occupied for their delay rounded up to whole timesteps of the TEN
+                    and every transmission is received on a timestep boundary
+        :param precondition_time: time at which each precondition arrives (default: 0), to continue a schedule
+        :param link_available_from: time at which each link becomes free (default: 0), to continue a schedule
+        """
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+
+        self.compiled = topology.compile(self.chunk_size)
+        self.node_list = self.compiled.node_list
+        self.edge_list = self.compiled.edge_list
+        self.chunk_list: List[ChunkId] = sorted(collective.chunks)
+        self.node_index = self.compiled.node_index
+        self.edge_index = self.compiled.edge_index
+        self.chunk_index: Dict[ChunkId, int] = {chunk: i for i, chunk in enumerate(self.chunk_list)}
+
+        self.src = self.compiled.src
+        self.dest = self.compiled.dest
+        self.delay = self.compiled.delay
+        self.ten = ten
+        # time a link is occupied by a transmission
+        self.duration = self.delay if ten is None else ten.link_steps*ten.timestep
+        self.receiver_driven = receiver_driven
+        # time a link is occupied before the current_time at which a transmission is matched
+        self.offset = self.duration if receiver_driven else np.zeros_like(self.duration)
+
+        self.current_time: Time = 0
+        # persistent event history: (event, previous log) cons cells
+        self.event_log: Optional[Tuple[Event, tuple]] = None
+        self.num_events = 0
+        # False when the arrays are shared with a fork and must be copied before writing
+        self.owns_arrays = True
+
+        self.link_available_from = np.zeros(len(self.edge_list), dtype=np.float64)
+        self.chunk_arrival_at_node = np.full((len(self.node_list), len(self.chunk_list)), np.inf, dtype=np.float64)
+        self.postcondition = np.zeros((len(self.node_list), len(self.chunk_list)), dtype=bool)
+        for chunk, node in collective.precondition:
+            self.chunk_arrival_at_node[self.node_index[node], self.chunk_index[chunk]] = 0 if precondition_time is None else precondition_time.get((chunk, node), 0)
+        for chunk, node in collective.postcondition:
+            self.postcondition[self.node_index[node], self.chunk_index[chunk]] = True
+        if link_available_from is not None:
+            for edge, link_time in link_available_from.items():
+                self.link_available_from[self.edge_index[edge]] = link_time
+        # every match delivers a needed chunk, so completion is tracked with a counter
+        self.remaining_postconditions = int(np.count_nonzero(self.postcondition & (self.chunk_arrival_at_node == np.inf)))
+        self.last_postcondition_arrival: Time = float(np.max(self.chunk_arrival_at_node, where=self.postcondition & (self.chunk_arrival_at_node != np.inf), initial=0))
+        # number of (node, chunk) pairs with a scheduled arrival
+        self.num_arrivals = int(np.count_nonzero(self.chunk_arrival_at_node != np.inf))
+        # shortest-path distance to each (node, chunk) from the nearest node with the chunk, see track_nearest_holders()
+        self.shortest_paths: Optional[np.ndarray] = None
+        self.nearest_holder_distance: Optional[np.ndarray] = None
+
+        self.out_edges: List[List[int]] = [self.compiled.get_out_edges(node).tolist() for node in range(len(self.node_list))]
+        self.in_edges: List[List[int]] = [self.compiled.get_in_edges(node).tolist() for node in range(len(self.node_list))]
+
+        # Candidate index
+        # ready_chunks[edge]: chunks the link src has in time to send at current_time and its dest still needs
+        # available_links: links that are free for a transmission matched at current_time
+        # candidates: flat list of productive (link, chunk) pairs for O(1) uniform sampling
+        self.ready_chunks: List[Set[int]] = [set() for _ in self.edge_list]
+        # links whose ready set is not shared with a fork (None: all of them)
+        self.owned_ready_chunks: Optional[Set[int]] = None
+        self.available_links: Set[int] = set()
+        self.candidates: List[Tuple[int, int]] = []
+        self.candidate_position: Dict[Tuple[int, int], int] = {}
+        # min-heap of (ready time, link, chunk) for chunks that will become ready to send on a link
+        self.pending_chunks: List[Tuple[Time, int, int]] = []
+        for node, chunk in zip(*np.nonzero(self.chunk_arrival_at_node != np.inf)):
+            self._push_pending_chunks(node=int(node), chunk=int(chunk))
+        # min-heap of (ready time, link) for busy links
+        self.pending_links: List[Tuple[Time, int]] = []
+        for edge, link_time in enumerate((self.link_available_from + self.offset).tolist()):
+            if link_time <= self.current_time:
+                self.available_links.add(edge)
+            else:
+                heapq.heappush(self.pending_links, (link_time, edge))
+        self.advance(self.current_time)
+
+    def copy(self) -> "SynthesisState":
+        """
+        Fork the state. Immutable inputs are shared and mutable state is copied on write,
+        so the parent and the fork can both keep matching independently.
+
+        :return: forked state
+        """
+        self.owns_arrays = False
+        self.owned_ready_chunks = set()
+        state = copy(self)
+        state.owned_ready_chunks = set()
+        state.ready_chunks = list(self.ready_chunks)
+        state.available_links = set(self.available_links)
+        state.candidates = list(self.candidates)
+        state.candidate_position = dict(self.candidate_position)
+        state.pending_chunks = list(self.pending_chunks)
+        state.pending_links = list(self.pending_links)
+        return state
+
+    def track_nearest_holders(self, shortest_paths: np.ndarray) -> None:
+        """
+        Start maintaining nearest_holder_distance, which match() updates with one vectorized minimum per arrival.
+        Chunks count as held from the moment they are matched.
+
+        :param shortest_paths: (nodes x nodes) shortest-path distances, indexed [src, dest]
+        """
+        self.shortest_paths = shortest_paths
+        self.nearest_holder_distance = np.full(self.chunk_arrival_at_node.shape, np.inf)
+        for node, chunk in zip(*np.nonzero(self.chunk_arrival_at_node != np.inf)):
+            np.minimum(self.nearest_holder_distance[:, chunk], shortest_paths[node], out=self.nearest_holder_distance[:, chunk])
+
+    def state_key(self) -> bytes:
+        """
+        Canonical digest of the state: current_time, every chunk arrival time, and every link's availability.
+        The candidate index and heaps are determined by these, so states with equal keys are equivalent.
+        The digest is stable across processes.
+
+        :return: 16-byte digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.float64(self.current_time).tobytes())
+        digest.update(self.chunk_arrival_at_node.tobytes())
+        digest.update(self.link_available_from.tobytes())
+        return digest.digest()
+
+    @property
+    def event_history(self) -> List[Event]:
+        events = []
+        log = self.event_log
+        while log is not None:
+            event, log = log
+            events.append(event)
+        return events[::-1]
+
+    def get_last_events(self, count: int) -> List[Event]:
+        """
+        :param count: number of most recent events
+        :return: the most recent events, oldest first
+        """
+        events = []
+        log = self.event_log
+        for _ in range(count):
+            event, log = log
+            events.append(event)
+        return events[::-1]
+
+    def _writable_ready_chunks(self, edge: int) -> Set[int]:
+        if self.owned_ready_chunks is not None and edge not in self.owned_ready_chunks:
+            self.ready_chunks[edge] = set(self.ready_chunks[edge])
+            self.owned_ready_chunks.add(edge)
+        return self.ready_chunks[edge]
+
+    def satisfied(self) -> bool:
+        return self.remaining_postconditions == 0 and self.last_postcondition_arrival <= self.current_time
+
+    def get_available_links(self) -> np.ndarray:
+        """
+        :return: indices of links that are free for a transmission matched at current_time
+        """
+        return np.array(sorted(self.available_links), dtype=np.int64)
+
+    def get_chunks_at_node(self, node: int, at_time: Time) -> np.ndarray:
+        """
+        :param node: node index
+        :param at_time: time by which the chunks must have arrived
+        :return: indices of chunks at the node by at_time
+        """
+        return np.flatnonzero(self.chunk_arrival_at_node[node] <= at_time)
+
+    def is_productive_link_chunk_match(self, edge: int, chunk: int) -> bool:
+        return (edge, chunk) in self.candidate_position
+
+    def get_possible_link_chunk_matches(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (link indices, chunk indices) of every productive match at current_time
+        """
+        candidates = np.array(self.candidates, dtype=np.int64).reshape(-1, 2)
+        return candidates[:, 0], candidates[:, 1]
+
+    def sample_candidate(self, rng) -> Tuple[int, int]:
+        """
+        Uniformly sample a productive match without materializing the candidate list.
+
+        :param rng: random.Random instance
+        :return: (link index, chunk index)
+        """
+        return self.candidates[rng.randrange(len(self.candidates))]
+
+    def _add_candidate(self, edge: int, chunk: int) -> None:
+        self.candidate_position[(edge, chunk)] = len(self.candidates)
+        self.candidates.append((edge, chunk))
+
+    def _remove_candidate(self, edge: int, chunk: int) -> None:
+        position = self.candidate_position.pop((edge, chunk), None)
+        if position is None:
+            return
+        last = self.candidates.pop()
+        if position < len(self.candidates):
+            self.candidates[position] = last
+            self.candidate_position[last] = position
+
+    def _push_pending_chunks(self, node: int, chunk: int) -> None:
+        arrival_time = self.chunk_arrival_at_node[node, chunk]
+        for edge in self.out_edges[node]:
+            dest = self.dest[edge]
+            if self.postcondition[dest, chunk] and self.chunk_arrival_at_node[dest, chunk] == np.inf:
+                heapq.heappush(self.pending_chunks, (float(arrival_time + self.offset[edge]), edge, chunk))
+
+    def advance(self, time: Time) -> None:
+        """
+        Move current_time forward and add the links and chunks that became ready to the candidate index.
+
+        :param time: new current_time
+        """
+        self.current_time = time
+        while len(self.pending_links) > 0 and self.pending_links[0][0] <= time:
+            _, edge = heapq.heappop(self.pending_links)
+            self.available_links.add(edge)
+            for chunk in self.ready_chunks[edge]:
+                self._add_candidate(edge, chunk)
+        while len(self.pending_chunks) > 0 and self.pending_chunks[0][0] <= time:
+            _, edge, chunk = heapq.heappop(self.pending_chunks)
+            if self.chunk_arrival_at_node[self.dest[edge], chunk] != np.inf or chunk in self.ready_chunks[edge]:
+                continue
+            self._writable_ready_chunks(edge).add(chunk)
+            if edge in self.available_links:
+                self._add_candidate(edge, chunk)
+
+    def match(self, edge: int, chunk: int) -> Event:
+        """
+        Commit a transmission of a chunk over a link.
+
+        :param edge: link index
+        :param chunk: chunk index
+        :return: the committed event
+        """
+        edge, chunk = int(edge), int(chunk)
+        if not self.is_productive_link_chunk_match(edge=edge, chunk=chunk):
+            raise ValueError(f"Attempted invalid link chunk match: {self.edge_list[edge]}, {self.chunk_list[chunk]}")
+        if self.receiver_driven:
+            send_time = float(self.current_time - self.delay[edge])
+            receive_time = self.current_time
+        elif self.ten is None:
+            send_time = self.current_time
+            receive_time = float(self.current_time + self.delay[edge])
+        else:
+            # the transmission is sent late enough to finish exactly on the timestep boundary
+            receive_time = float(self.current_time + self.duration[edge])
+            send_time = float(receive_time - self.delay[edge])
+        event = (self.edge_list[edge], self.chunk_list[chunk], send_time, receive_time)
+        self.event_log = (event, self.event_log)
+        self.num_events += 1
+        if not self.owns_arrays:
+            self.link_available_from = self.link_available_from.copy()
+            self.chunk_arrival_at_node = self.chunk_arrival_at_node.copy()
+            if self.nearest_holder_distance is not None:
+                self.nearest_holder_distance = self.nearest_holder_distance.copy()
+            self.owns_arrays = True
+
+        # link is busy
+        self.link_available_from[edge] = receive_time
+        self.available_links.discard(edge)
+        heapq.heappush(self.pending_links, (float(receive_time + self.offset[edge]), edge))
+        for ready_chunk in self.ready_chunks[edge]:
+            self._remove_candidate(edge, ready_chunk)
+        # dest has the chunk, so no link needs to deliver it there anymore
+        dest = int(self.dest[edge])
+        self.chunk_arrival_at_node[dest, chunk] = receive_time
+        self.num_arrivals += 1
+        if self.nearest_holder_distance is not None:
+            np.minimum(self.nearest_holder_distance[:, chunk], self.shortest_paths[dest], out=self.nearest_holder_distance[:, chunk])
+        self.remaining_postconditions -= 1
+        self.last_postcondition_arrival = max(self.last_postcondition_arrival, receive_time)
+        for in_edge in self.in_edges[dest]:
+            if chunk in self.ready_chunks[in_edge]:
+                self._writable_ready_chunks(in_edge).discard(chunk)
+                self._remove_candidate(in_edge, chunk)
+        # dest can forward the chunk once it arrives
+        self._push_pending_chunks(node=dest, chunk=chunk)
+        return event
+
+    def match_links(self, links: List[int], choose_chunk) -> List[Event]:
+        """
+        Match the given free links at current_time in one pass: each link takes one of its ready chunks,
+        and a chunk delivered to a node is dropped from the other links into that node.
+        Matches only remove candidates at current_time, so afterwards no productive match is left.
+
+        :param links: indices of available links, in the order they pick a chunk
+        :param choose_chunk: function (link index, ready chunk indices) -> chunk index
+        :return: the committed events
+        """
+        events = []
+        for edge in links:
+            if len(self.ready_chunks[edge]) > 0:
+                events.append(self.match(edge=edge, chunk=choose_chunk(edge, self.ready_chunks[edge])))
+        return events
+
+    def complete(self) -> List[Event]:
+        """
+        Finish the schedule cheaply, e.g., once a time budget has expired: every chunk that still has unmet
+        postconditions is sent along its earliest-arrival routes (see earliest_arrival_routes()), and the route
+        transmissions are list-scheduled on the links in earliest-arrival order. The result is valid but not tuned,
+        and the candidate index is left stale, so the state must not be matched or advanced afterwards.
+
+        :return: the committed events
+        """
+        if not self.owns_arrays:
+            self.link_available_from = self.link_available_from.copy()
+            self.chunk_arrival_at_node = self.chunk_arrival_at_node.copy()
+            if self.nearest_holder_distance is not None:
+                self.nearest_holder_distance = self.nearest_holder_distance.copy()
+            self.owns_arrays = True
+        missing = self.postcondition & (self.chunk_arrival_at_node == np.inf)
+        edges, chunks = earliest_arrival_routes(self.chunk_arrival_at_node, self.link_available_from, self.duration,
+                                                self.src, self.dest, missing)
+        # list-schedule the route transmissions: a parent always precedes its child in earliest-arrival order
+        arrival, link_free = self.chunk_arrival_at_node.tolist(), self.link_available_from.tolist()
+        src, dest, delay, duration = self.src.tolist(), self.dest.tolist(), self.delay.tolist(), self.duration.tolist()
+        events = []
+        for edge, chunk in zip(edges.tolist(), chunks.tolist()):
+            receive_time = max(arrival[src[edge]][chunk], link_free[edge]) + duration[edge]
+            event = (self.edge_list[edge], self.chunk_list[chunk], receive_time - delay[edge], receive_time)
+            self.event_log = (event, self.event_log)
+            events.append(event)
+            link_free[edge] = receive_time
+            arrival[dest[edge]][chunk] = receive_time
+        self.num_events += len(events)
+        self.num_arrivals += len(events)
+        self.chunk_arrival_at_node[:] = arrival
+        self.link_available_from[:] = link_free
+        self.last_postcondition_arrival = max(self.last_postcondition_arrival,
+                                              float(np.max(self.chunk_arrival_at_node, where=self.postcondition, initial=0)))
+        self.remaining_postconditions = 0
+        self.current_time = max(self.current_time, self.last_postcondition_arrival)
+        return events
+
+    def next_link_time(self) -> Time:
+        """
+        :return: earliest time after current_time at which a busy link frees up or a chunk becomes ready on a link
+        """
+        # with heterogeneous delays a chunk can become ready on an idle link before any busy link frees up
+        times = [heap[0][0] for heap in (self.pending_links, self.pending_chunks) if len(heap) > 0]
+        if len(times) == 0:
+            raise ValueError(f"No link frees up after time {self.current_time}, so the postcondition cannot be satisfied")
+        return min(times)
@@ -0,0 +1,237 @@
+import csv
+import numpy as np
+import gurobipy as gp
+from gurobipy import GRB
+from collections import defaultdict
+from helper.typing import *
+from topology.topology import Topology
+from topology.time_expanded_network import TimeExpandedNetwork
+from collective.collective import Collective
+from synthesizer.ilp_synthesizer import compute_send_windows
+from synthesizer.ten_synthesizer import TENSynthesizer
+
+class TENILPSynthesizer:
+    """
+    Time-indexed ILP on the time-expanded network, as an alternative to the big-M ordering formulation of ILPSynthesizer.
+    x[send, t] is 1 if the send's link delivers its chunk at timestep t (so it is sent at t-link_steps),
+    h[node, chunk, t] is 1 if the node holds the chunk by timestep t, and z[t] is 1 while the collective is unfinished,
+    so the collective time is sum(z) timesteps. The horizon is the collective time of a TENSynthesizer schedule,
+    which is also loaded as the MIP start. The model grows with the horizon in timesteps, and its link capacity
+    constraints with the link delays in timesteps too, so a model with more than max_variables variables or
+    max_nonzeros link capacity coefficients is rejected before it is built.
+    """
+    def __init__(self, topology: Topology, collective: Collective, timestep: Optional[Time] = None, horizon: Optional[TenTimestep] = None,
+                 max_variables: int = 10**6, max_nonzeros: int = 10**7, seed=None):
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        self.compiled = self.topology.compile(self.chunk_size)
+        self.chunk_list: List[ChunkId] = sorted(self.chunks)
+        self.chunk_index: Dict[ChunkId, int] = {chunk: i for i, chunk in enumerate(self.chunk_list)}
+        self.ten = TimeExpandedNetwork(self.compiled, timestep=timestep)
+        self.max_variables = max_variables
+        self.max_nonzeros = max_nonzeros
+
+        heuristic = TENSynthesizer(topology=topology, collective=collective, timestep=self.ten.timestep, seed=seed)
+        heuristic.solve()
+        self.horizon: TenTimestep = heuristic.current_step if horizon is None else horizon
+
+        self.model = gp.Model("SynthesizeCollectiveAlgorithmTEN")
+        self._prune_vars()
+        self._initialize_vars()
+        self._set_objective()
+        self._set_constraints()
+        if heuristic.current_step <= self.horizon:
+            self._set_start(heuristic.ten_events)
+
+    def _node_chunk_keys(self, pairs) -> np.ndarray:
+        return np.array([self.compiled.node_index[node]*len(self.chunk_list) + self.chunk_index[chunk] for chunk, node in pairs], dtype=np.int64)
+
+    def _prune_vars(self) -> None:
+        """
+        Find the (send, timestep) variables the model needs: sends come from compute_send_windows() with the horizon as
+        upper bound, and each send's timesteps from its send window rounded to whole timesteps.
+        Raises ValueError if the model would have more than max_variables variables or max_nonzeros link capacity coefficients.
+        """
+        compiled = self.compiled
+        link_steps = self.ten.link_steps
+        timestep = self.ten.timestep
+        feasible, earliest_send, latest_send = compute_send_windows(compiled, self.collective, self.chunk_list, upper_bound=self.horizon*timestep)
+        send_edge, send_chunk = np.nonzero(feasible.T)
+        # shortest paths in timesteps are at least the continuous ones divided by the timestep
+        first_step = np.ceil(earliest_send[send_chunk, send_edge]/timestep - 1e-9).astype(np.int64) + link_steps[send_edge]
+        last_step = np.floor((latest_send[send_chunk, send_edge] + compiled.delay[send_edge])/timestep + 1e-9).astype(np.int64)
+
+        num_chunks = len(self.chunk_list)
+        self.precondition_keys = self._node_chunk_keys(self.collective.precondition)
+        self.needed_keys = np.setdiff1d(self._node_chunk_keys(self.collective.postcondition), self.precondition_keys)
+        src_key = compiled.src[send_edge]*num_chunks + send_chunk
+        dest_key = compiled.dest[send_edge]*num_chunks + send_chunk
+        # a chunk can only leave a node that starts with it or that some send delivers it to
+        keep = (first_step <= last_step) & (np.isin(src_key, self.precondition_keys) | np.isin(src_key, dest_key))
+        self.send_edge, self.send_chunk = send_edge[keep], send_chunk[keep]
+        self.send_src_key, self.send_dest_key = src_key[keep], dest_key[keep]
+        first_step, last_step = first_step[keep], last_step[keep]
+        counts = last_step - first_step + 1
+
+        # nodes that can receive a chunk get a holding variable per timestep 0..horizon, indexed key position*(horizon+1)+t
+        self.holder_keys = np.unique(self.send_dest_key)
+        if not np.all(np.isin(self.needed_keys, self.holder_keys)):
+            raise ValueError(f"Postcondition cannot be satisfied within {self.horizon} timesteps")
+        num_variables = int(counts.sum()) + len(self.holder_keys)*(self.horizon+1) + self.horizon
+        # every (send, timestep) variable is in at most one link capacity window per timestep of its link delay
+        num_nonzeros = int((counts*np.minimum(link_steps[self.send_edge], self.horizon+1)).sum())
+        if num_variables > self.max_variables or num_nonzeros > self.max_nonzeros:
+            raise ValueError(f"TEN ILP would have {num_variables} variables and up to {num_nonzeros} link capacity coefficients over "
+                             f"{self.horizon} timesteps of {timestep} ns, more than max_variables={self.max_variables} or "
+                             f"max_nonzeros={self.max_nonzeros}: use a coarser timestep or a shorter horizon")
+
+        # (send, timestep) variables, contiguous per send
+        self.x_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.x_send = np.repeat(np.arange(len(self.send_edge)), counts)
+        self.x_step = first_step[self.x_send] + np.arange(len(self.x_send)) - self.x_offsets[self.x_send]
+
+    def _holder_index(self, keys: np.ndarray, steps) -> np.ndarray:
+        return np.searchsorted(self.holder_keys, keys)*(self.horizon+1) + steps
+
+    def _initialize_vars(self) -> None:
+        self.send_bool = self.model.addMVar(len(self.x_send), vtype=GRB.BINARY, name="x")
+        self.hold = self.model.addMVar(len(self.holder_keys)*(self.horizon+1), lb=0., ub=1., vtype=GRB.CONTINUOUS, name="h")
+        self.unfinished = self.model.addMVar(self.horizon, lb=0., ub=1., vtype=GRB.CONTINUOUS, name="z")
+
+    def _set_objective(self) -> None:
+        self.model.setObjective(self.unfinished.sum(), sense=GRB.MINIMIZE)
+
+    def _set_constraints(self) -> None:
+        horizon = self.horizon
+        send_bools = self.send_bool.tolist()
+        holds = self.hold.tolist()
+        x_dest = self._holder_index(self.send_dest_key[self.x_send], self.x_step)
+
+        # A node holds a chunk at t only if it held it at t-1 or a link delivers it at t, and keeps it afterwards
+        x_by_dest = np.argsort(x_dest, kind="stable")
+        deliveries = np.split(x_by_dest, np.searchsorted(x_dest[x_by_dest], np.arange(1, len(holds))))
+        for hold, delivered in enumerate(deliveries):
+            step = hold % (horizon+1)
+            previous = [holds[hold-1]] if step > 0 else []
+            self.model.addLConstr(gp.LinExpr([1.] + [-1.]*(len(previous)+len(delivered)), [holds[hold]] + previous + [send_bools[x] for x in delivered]), GRB.LESS_EQUAL, 0., name=f"receive[{hold}]")
+        later = np.flatnonzero(np.arange(len(holds)) % (horizon+1) > 0)
+        if len(later) > 0:
+            self.model.addConstr(self.hold[later] >= self.hold[later-1], name="keep")
+        # A link only sends a chunk its src holds
+        relayed = np.flatnonzero(~np.isin(self.send_src_key[self.x_send], self.precondition_keys))
+        if len(relayed) > 0:
+            src_hold = self._holder_index(self.send_src_key[self.x_send[relayed]], self.x_step[relayed] - self.ten.link_steps[self.send_edge[self.x_send[relayed]]])
+            self.model.addConstr(self.send_bool[relayed] <= self.hold[src_hold], name="sender_possesses")
+        # A link sends each chunk at most once
+        for send in range(len(self.send_edge)):
+            start, end = self.x_offsets[send], self.x_offsets[send+1]
+            if end - start > 1:
+                self.model.addLConstr(gp.LinExpr([1.]*(end-start), send_bools[start:end]), GRB.LESS_EQUAL, 1., name=f"send_once[{send}]")
+        # A link carries one chunk at a time: at most one delivery per window of link_steps timesteps
+        x_edge = self.send_edge[self.x_send]
+        x_by_edge = np.lexsort((self.x_step, x_edge))
+        edge_starts = np.searchsorted(x_edge[x_by_edge], np.arange(self.compiled.num_edges+1))
+        for edge in range(self.compiled.num_edges):
+            edge_x = x_by_edge[edge_starts[edge]:edge_starts[edge+1]]
+            edge_steps = self.x_step[edge_x]
+            link_steps = int(self.ten.link_steps[edge])
+            for step in np.unique(edge_steps).tolist():
+                window = edge_x[(edge_steps >= step) & (edge_steps < step+link_steps)]
+                if len(window) > 1:
+                    self.model.addLConstr(gp.LinExpr([1.]*len(window), [send_bools[x] for x in window]), GRB.LESS_EQUAL, 1., name=f"link_capacity[{edge},{step}]")
+        # All postconditions are held at the horizon
+        self.model.addConstr(self.hold[self._holder_index(self.needed_keys, horizon)] == 1, name="postcondition")
+        # The collective is unfinished at t while some postcondition is not held
+        if horizon > 0 and len(self.needed_keys) > 0:
+            needed, steps = np.repeat(self.needed_keys, horizon), np.tile(np.arange(horizon), len(self.needed_keys))
+            self.model.addConstr(self.unfinished[steps] + self.hold[self._holder_index(needed, steps)] >= 1, name="postcondition_time")
+
+    def _set_start(self, ten_events: List[Tuple[np.ndarray,np.ndarray,TenTimestep]]) -> None:
+        """
+        Load a TENSynthesizer schedule as the MIP start.
+
+        :param ten_events: (link indices, chunk indices, finish timestep) of the schedule's transmissions
+        """
+        x_index = {(edge, chunk, step): x for x, (edge, chunk, step) in enumerate(zip(self.send_edge[self.x_send].tolist(), self.send_chunk[self.x_send].tolist(), self.x_step.tolist()))}
+        send_bool = np.zeros(len(self.x_send))
+        arrival = np.full(len(self.holder_keys), self.horizon+1)
+        makespan = 0
+        for edges, chunks, step in ten_events:
+            for edge, chunk in zip(edges.tolist(), chunks.tolist()):
+                x = x_index.get((edge, chunk, step))
+                if x is not None:
+                    send_bool[x] = 1
+                    holder = np.searchsorted(self.holder_keys, self.send_dest_key[self.x_send[x]])
+                    arrival[holder] = min(arrival[holder], step)
+            makespan = max(makespan, step)
+        self.send_bool.Start = send_bool
+        self.hold.Start = (np.arange(self.horizon+1)[None, :] >= arrival[:, None]).astype(np.float64).ravel()
+        self.unfinished.Start = (np.arange(self.horizon) < makespan).astype(np.float64)
+
+    def solve(self, time_limit: float = None, verbose: bool = False, filename: str = None) -> None:
+        if time_limit is not None:
+            self.model.Params.TimeLimit = time_limit
+        self.model.Params.OutputFlag = verbose
+        if filename is not None:
+            self.model.write(filename)
+        try:
+            self.model.optimize()
+        except:
+            raise Exception("Gurobi cannot solve this ILP!")
+        if self.model.Status in (GRB.INFEASIBLE, GRB.INF_OR_UNBD):
+            raise ValueError(f"No schedule finishes within the horizon of {self.horizon} timesteps")
+        if self.model.SolCount == 0:
+            raise ValueError(f"Gurobi stopped without a schedule (status {self.model.Status}), e.g., the time limit ran out first")
+        self._extract_events()
+
+    def _extract_events(self) -> None:
+        # one bulk read of x, then drop deliveries after the last postcondition arrival, which nothing can need
+        chosen = np.flatnonzero(self.send_bool.X > 0.5)
+        arrival = defaultdict(lambda: self.horizon+1)
+        for x in chosen.tolist():
+            key = int(self.send_dest_key[self.x_send[x]])
+            arrival[key] = min(arrival[key], int(self.x_step[x]))
+        self.current_step: TenTimestep = max((arrival[key] for key in self.needed_keys.tolist()), default=0)
+        self.events: List[Event] = []
+        for x in chosen[self.x_step[chosen] <= self.current_step].tolist():
+            edge = self.send_edge[self.x_send[x]]
+            receive_time = self.ten.to_time(int(self.x_step[x]))
+            self.events.append((self.compiled.edge_list[edge], self.chunk_list[self.send_chunk[self.x_send[x]]], float(receive_time - self.compiled.delay[edge]), receive_time))
+
+    def write(self, filename: str) -> None:
+        self.model.write(filename)
+
+    @property
+    def current_time(self):
+        return self.ten.to_time(self.current_step)
+
+    @property
+    def event_history(self) -> List[Event]:
+        return self.events
+
+    def write_ten(self, filename: str) -> None:
+        self.ten.write_ten(filename, self.event_history)
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        edge_to_chunks = defaultdict(list)
+        for edge,chunk,send_time,receive_time in self.event_history:
+            edge_to_chunks[edge].append((chunk, send_time, receive_time))
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
@@ -0,0 +1,168 @@
+import csv
+import numpy as np
+from collections import defaultdict
+from helper.typing import *
+from helper.deadline import Deadline
+from topology.topology import Topology
+from topology.time_expanded_network import TimeExpandedNetwork
+from collective.collective import Collective
+from synthesizer.synthesis_state import earliest_arrival_routes
+
+class TENSynthesizer:
+    """
+    TACOS on a time-expanded network: link delays are whole timesteps and all state is integer arrays.
+    At each timestep every free link is matched at once with array operations: each link draws a random
+    ready chunk, and when several links deliver the same chunk to a node one of them wins at random and
+    the others draw again.
+    """
+    def __init__(self, topology: Topology, collective: Collective, timestep: Optional[Time] = None, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+        self.topology = topology
+        self.collective = collective
+        self.chunk_size = collective.chunk_size
+
+        self.nodes = self.topology.G.nodes
+        self.edges = self.topology.G.edges
+        self.chunks = self.collective.chunks
+
+        self.discretize(timestep)
+
+        compiled = self.ten.compiled
+        self.chunk_list: List[ChunkId] = sorted(collective.chunks)
+        chunk_index = {chunk: i for i, chunk in enumerate(self.chunk_list)}
+        self.src = compiled.src
+        self.dest = compiled.dest
+        self.link_steps = self.ten.link_steps
+
+        self.current_step: TenTimestep = 0
+        # timestep at which each (node, chunk) arrives, no_arrival if it has not been matched
+        self.no_arrival = np.iinfo(np.int64).max//4
+        self.arrival_step = np.full((compiled.num_nodes, len(self.chunk_list)), self.no_arrival, dtype=np.int64)
+        for chunk, node in collective.precondition:
+            self.arrival_step[compiled.node_index[node], chunk_index[chunk]] = 0
+        self.needed = np.zeros(self.arrival_step.shape, dtype=bool)
+        for chunk, node in collective.postcondition:
+            self.needed[compiled.node_index[node], chunk_index[chunk]] = True
+        self.needed &= self.arrival_step==self.no_arrival
+        # earliest timestep at which each link can finish its next transmission
+        self.link_free_step = self.link_steps.copy()
+        # (link index, chunk index, finish timestep) of every transmission
+        self.ten_events: List[Tuple[np.ndarray, np.ndarray, TenTimestep]] = []
+
+    def discretize(self, timestep: Optional[Time] = None) -> None:
+        self.ten = TimeExpandedNetwork(self.topology.compile(self.chunk_size), timestep=timestep)
+
+    @property
+    def current_time(self) -> Time:
+        return self.ten.to_time(self.current_step)
+
+    @property
+    def event_history(self) -> List[Event]:
+        compiled = self.ten.compiled
+        events = []
+        for edges, chunks, step in self.ten_events:
+            receive_time = self.ten.to_time(step)
+            for edge, chunk in zip(edges.tolist(), chunks.tolist()):
+                events.append((compiled.edge_list[edge], self.chunk_list[chunk], float(receive_time - compiled.delay[edge]), receive_time))
+        return events
+
+    def satisfied(self) -> bool:
+        return not self.needed.any()
+
+    def match_timestep(self) -> None:
+        """
+        Match every free link at current_step that has a productive chunk.
+        """
+        links = np.flatnonzero(self.link_free_step<=self.current_step)
+        if len(links)==0:
+            return
+        link_dests = self.dest[links]
+        ready = (self.arrival_step[self.src[links]]<=(self.current_step-self.link_steps[links])[:, None]) & self.needed[link_dests]
+        while True:
+            contenders = np.flatnonzero(ready.any(axis=1))
+            if len(contenders)==0:
+                break
+            # random ready chunk per link, then a random winner per (dest, chunk)
+            keys = np.where(ready[contenders], self.rng.random((len(contenders), ready.shape[1])), -1.)
+            chunks = np.argmax(keys, axis=1)
+            order = self.rng.permutation(len(contenders))
+            _, first = np.unique(link_dests[contenders[order]]*ready.shape[1]+chunks[order], return_index=True)
+            winners, winner_chunks = contenders[order[first]], chunks[order[first]]
+
+            edges = links[winners]
+            self.arrival_step[self.dest[edges], winner_chunks] = self.current_step
+            self.needed[self.dest[edges], winner_chunks] = False
+            self.link_free_step[edges] = self.current_step+self.link_steps[edges]
+            self.ten_events.append((edges, winner_chunks, self.current_step))
+            ready[winners] = False
+            ready &= self.needed[link_dests]
+
+    def next_step(self) -> TenTimestep:
+        """
+        :return: earliest timestep after current_step at which some link is free and has a productive chunk
+        """
+        # earliest finish timestep of a transmission of a needed chunk on each link
+        chunk_ready = np.where(self.needed[self.dest], self.arrival_step[self.src], self.no_arrival).min(axis=1)
+        reachable = chunk_ready<self.no_arrival
+        if not reachable.any():
+            raise ValueError(f"No link can deliver a needed chunk after timestep {self.current_step}, so the postcondition cannot be satisfied")
+        steps = np.maximum(np.maximum(chunk_ready[reachable]+self.link_steps[reachable], self.link_free_step[reachable]), self.current_step+1)
+        return int(steps.min())
+
+    def complete(self) -> None:
+        """
+        Finish the schedule cheaply: every chunk that is still needed is sent along its earliest-arrival routes
+        (see earliest_arrival_routes()), and the route transmissions are list-scheduled in whole timesteps.
+        """
+        arrival = np.where(self.arrival_step==self.no_arrival, np.inf, self.arrival_step.astype(np.float64))
+        # a link can start its next transmission link_steps before it can finish it
+        edges, chunks = earliest_arrival_routes(arrival, self.link_free_step-self.link_steps, self.link_steps,
+                                                self.src, self.dest, self.needed)
+        for edge, chunk in zip(edges.tolist(), chunks.tolist()):
+            step = int(max(self.arrival_step[self.src[edge], chunk], self.link_free_step[edge]-self.link_steps[edge]) + self.link_steps[edge])
+            self.arrival_step[self.dest[edge], chunk] = step
+            self.needed[self.dest[edge], chunk] = False
+            self.link_free_step[edge] = step+self.link_steps[edge]
+            self.ten_events.append((np.array([edge]), np.array([chunk]), step))
+            self.current_step = max(self.current_step, step)
+
+    def solve(self, time_budget: Optional[float] = None) -> None:
+        """
+        Run the rollout until the postcondition is satisfied.
+        Once time_budget seconds have passed, the rest of the schedule is finished by complete().
+        The budget is a soft limit: it is checked between time points and the completion runs after it,
+        and the completed schedule is not tuned, so its collective time can be up to about twice as long.
+
+        :param time_budget: soft wall clock budget in seconds (None for no budget)
+        """
+        deadline = Deadline(time_budget)
+        while True:
+            self.match_timestep()
+            if self.satisfied():
+                break
+            if deadline.expired():
+                self.complete()
+                break
+            self.current_step = self.next_step()
+
+    def write_ten(self, filename: str) -> None:
+        self.ten.write_ten(filename, self.event_history)
+
+    def write_csv(self, filename: str, synthesis_time: float) -> None:
+        edge_to_chunks = defaultdict(list)
+        for edge,chunk,send_time,receive_time in self.event_history:
+            edge_to_chunks[edge].append((chunk, send_time, receive_time))
+
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",len(self.nodes)])
+            writer.writerow(["Links Count",len(self.edges)])
+            writer.writerow(["Chunks Count",len(self.chunks)])
+            writer.writerow(["Chunk Size",self.chunk_size])
+            writer.writerow(["Collective Time",self.current_time,"ns"])
+            writer.writerow(["Synthesis Time",synthesis_time,"s"])
+            writer.writerow(["SrcID","DestID","Latency (ns)","Bandwidth (GB/s)","Chunks (ID:ns:ns)"])
+            for edge in self.edges:
+                src, dest = edge
+                writer.writerow([src,dest,self.edges[edge]["alpha"],self.edges[edge]["beta"]]+[":".join(str(y) for y in x) for x in edge_to_chunks[edge]])
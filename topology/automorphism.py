@@ -0,0 +1,114 @@
+import itertools
+import numpy as np
+import networkx as nx
+from networkx.algorithms.isomorphism import DiGraphMatcher
+from helper.typing import *
+from topology.topology import Topology
+
+
+def regular_automorphism_group(topology: Topology, generators: Optional[List[Dict[NpuId,NpuId]]] = None, max_candidates: int = 100) -> Optional[np.ndarray]:
+    """
+    Find a group of automorphisms that maps every NPU to every other NPU in exactly one way (i.e., acts regularly,
+    like the translations of a torus), and keeps the alpha and beta of every link.
+
+    Without generators, an abelian group (e.g., the translations of a torus or a hypercube) is searched for by
+    backtracking: a generator is picked with VF2 for every NPU that the first NPU links to, among the fixed-point-free
+    automorphisms that commute with the generators so far. At most max_candidates automorphisms are enumerated per
+    NPU, and at most max_candidates are tried in total.
+
+    :param topology: topology
+    :param generators: automorphisms that generate the group (e.g., Topology.automorphisms), searched for if empty
+    :param max_candidates: largest number of automorphisms enumerated per generator and tried in total
+    :return: (NPUs x NPUs) array of node indices of the compiled topology, where row v is the automorphism that maps
+             node index 0 to v, or None if no such group is found
+    """
+    compiled = topology.compile()
+    node_list, node_index = compiled.node_list, compiled.node_index
+    if generators:
+        permutations = []
+        for generator in generators:
+            permutation = np.array([node_index[generator[node]] for node in node_list], dtype=np.int64)
+            if not _is_automorphism(topology, permutation):
+                raise ValueError(f"Not an automorphism of the topology: {generator}")
+            permutations.append(permutation)
+        group = _generate_group(permutations, compiled.num_nodes)
+        return group if group is not None and not np.any(group[:, 0]<0) else None
+
+    root = node_list[0]
+    pinned = nx.DiGraph()
+    pinned.add_nodes_from(node_list, pinned=False)
+    pinned.add_edges_from(topology.G.edges(data=True))
+    pinned.nodes[root]["pinned"] = True
+    image = pinned.copy()
+    image.nodes[root]["pinned"] = False
+    targets = [node_index[target] for target in topology.G.successors(root)]
+    candidates: Dict[int, List[np.ndarray]] = {}
+    tries = 0
+
+    def search(permutations: List[np.ndarray], group: np.ndarray) -> Optional[np.ndarray]:
+        nonlocal tries
+        target = next((target for target in targets if group[target, 0]<0), None)
+        if target is None:
+            return group
+        if target not in candidates:
+            image.nodes[node_list[target]]["pinned"] = True
+            matcher = DiGraphMatcher(pinned, image,
+                                     node_match=lambda a, b: a["pinned"]==b["pinned"],
+                                     edge_match=lambda a, b: a["alpha"]==b["alpha"] and a["beta"]==b["beta"])
+            permutations_to_target = (np.array([node_index[mapping[node]] for node in node_list], dtype=np.int64) for mapping in itertools.islice(matcher.isomorphisms_iter(), max_candidates))
+            # every element of a regular group but the identity moves every NPU
+            candidates[target] = [permutation for permutation in permutations_to_target if not np.any(permutation==np.arange(len(node_list)))]
+            image.nodes[node_list[target]]["pinned"] = False
+        for permutation in candidates[target]:
+            if tries>=max_candidates:
+                return None
+            # commuting generators generate an abelian group, which acts regularly as it is transitive
+            if not all(np.array_equal(permutation[other], other[permutation]) for other in permutations):
+                continue
+            tries += 1
+            extension = _generate_group(permutations+[permutation], compiled.num_nodes)
+            result = search(permutations+[permutation], extension) if extension is not None else None
+            if result is not None:
+                return result
+        return None
+
+    group = search([], _generate_group([], compiled.num_nodes))
+    # the NPUs the group maps the first NPU to are closed under links, so they are all NPUs if it is strongly connected
+    return group if group is not None and not np.any(group[:, 0]<0) else None
+
+
+def _is_automorphism(topology: Topology, permutation: np.ndarray) -> bool:
+    """
+    :param topology: topology
+    :param permutation: image of every node index
+    :return: whether the permutation maps every link to a link with the same alpha and beta
+    """
+    compiled = topology.compile()
+    if not np.array_equal(np.sort(permutation), np.arange(compiled.num_nodes)):
+        return False
+    for edge, (src, dest) in enumerate(zip(compiled.src.tolist(), compiled.dest.tolist())):
+        image = compiled.edge_index.get((compiled.node_list[permutation[src]], compiled.node_list[permutation[dest]]))
+        if image is None or compiled.alpha[image]!=compiled.alpha[edge] or compiled.beta[image]!=compiled.beta[edge]:
+            return False
+    return True
+
+
+def _generate_group(permutations: List[np.ndarray], num_nodes: int) -> Optional[np.ndarray]:
+    """
+    :param permutations: generators, each the image of every node index
+    :param num_nodes: number of nodes
+    :return: (nodes x nodes) group elements by the image of node index 0 (-1 rows for unreached nodes),
+             or None if two elements map node index 0 to the same node, i.e., the group does not act regularly
+    """
+    group = np.full((num_nodes, num_nodes), -1, dtype=np.int64)
+    group[0] = np.arange(num_nodes)
+    queue = [0]
+    for element in queue:
+        for permutation in permutations:
+            product = group[element][permutation]
+            if group[product[0], 0]<0:
+                group[product[0]] = product
+                queue.append(product[0])
+            elif not np.array_equal(group[product[0]], product):
+                return None
+    return group
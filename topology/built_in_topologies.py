@@ -3,6 +3,7 @@ import ast
 import math
 import random
 import networkx as nx
+from helper.typing import *
 from topology.topology import Topology
 
 def tree_topology(degrees: list, latencies: list, bandwidths: list) -> Topology:
@@ -20,6 +21,19 @@ def tree_topology(degrees: list, latencies: list, bandwidths: list) -> Topology:
         nodes_at_current_level = next_level_nodes
     return tree.to_directed()
 
+def translations(labels: list) -> List[Dict[NpuId, NpuId]]:
+    """
+    Unit translations along every axis of a periodic grid (e.g., a torus or a hypercube).
+
+    :param labels: coordinates (tuples, or integers for a single axis) of the NPUs 0, 1, ...
+    :return: for every axis, the NPU each NPU is moved to
+    """
+    coordinates = [label if isinstance(label, tuple) else (label,) for label in labels]
+    index = {coordinate: node for node, coordinate in enumerate(coordinates)}
+    sizes = [max(axis)+1 for axis in zip(*coordinates)]
+    return [{node: index[coordinate[:axis]+((coordinate[axis]+1)%size,)+coordinate[axis+1:]] for node, coordinate in enumerate(coordinates)}
+            for axis, size in enumerate(sizes) if size>1]
+
 def get_topology(specifier: str) -> Topology:
     def parse_match(match: re.Match) -> dict:
         """Parses args named group in match: (?:__(?P<args>.*))?"""
@@ -44,13 +58,21 @@ def get_topology(specifier: str) -> Topology:
         proportion = args.pop("proportion") if "proportion" in args else 0.
 
         graph_function = getattr(nx, generator_name)
-        G = nx.convert_node_labels_to_integers(graph_function(**args)).to_directed()
+        graph = graph_function(**args)
+        G = nx.convert_node_labels_to_integers(graph).to_directed()
 
         heterogeneity = [(alpha,beta) for _ in range(math.floor((1-proportion)*len(G.edges)))]+[(alpha2,beta2) for _ in range(math.ceil(proportion*len(G.edges)))]
         random.shuffle(heterogeneity)
         for (src, dest), (link_alpha, link_beta) in zip(G.edges,heterogeneity):
             G.add_edge(src,dest,alpha=link_alpha,beta=link_beta)
-        return Topology(G=G)
+        topology = Topology(G=G)
+        if len(set(heterogeneity))==1:
+            # homogeneous graphs whose labels translate onto themselves
+            if generator_name=="hypercube_graph" or (generator_name=="grid_graph" and args.get("periodic", False) is True):
+                topology.automorphisms = translations(list(graph.nodes))
+            elif generator_name in ("cycle_graph", "circulant_graph", "complete_graph") and list(graph.nodes)==list(range(len(graph))):
+                topology.automorphisms = translations(list(graph.nodes))
+        return topology
     
     # Shortcuts
     elif match := re.match(r"^fc(?:__(?P<args>.*))?$", specifier):
@@ -59,7 +81,9 @@ def get_topology(specifier: str) -> Topology:
         G = nx.complete_graph(n=args["n"]).to_directed()
         for src, dest in G.edges:
             G.add_edge(src,dest,alpha=0.,beta=1.)
-        return Topology(G=G)
+        topology = Topology(G=G)
+        topology.automorphisms = translations(list(range(args["n"])))
+        return topology
     elif match := re.match(r"^grid(?:__(?P<args>.*))?$", specifier):
         # Line/Grid
         args = parse_match(match)
@@ -74,10 +98,13 @@ def get_topology(specifier: str) -> Topology:
     elif match := re.match(r"^torus(?:__(?P<args>.*))?$", specifier):
         # Ring/Torus
         args = parse_match(match)
-        G = nx.convert_node_labels_to_integers(nx.grid_graph(dim=args["dim"], periodic=True).to_directed())
+        graph = nx.grid_graph(dim=args["dim"], periodic=True)
+        G = nx.convert_node_labels_to_integers(graph.to_directed())
         for src, dest in G.edges:
             G.add_edge(src,dest,alpha=0.,beta=1.)
-        return Topology(G=G)
+        topology = Topology(G=G)
+        topology.automorphisms = translations(list(graph.nodes))
+        return topology
     elif match := re.match(r"^ring(?:__(?P<args>.*))?$", specifier):
         # Ring with bottleneck
         args = parse_match(match)
@@ -0,0 +1,86 @@
+import hashlib
+import numpy as np
+from helper.typing import *
+
+
+class CompiledTopology:
+    """
+    Contiguous, edge-indexed view of a Topology for a fixed chunk size.
+
+    Nodes and links are addressed by their position in node_list and edge_list.
+    Out- and in-adjacency are stored in CSR form: the links leaving node n are
+    out_edges[out_indptr[n]:out_indptr[n+1]] (likewise for in_edges/in_indptr).
+    """
+
+    def __init__(self,
+                 node_list: List[NpuId],
+                 edge_list: List[LinkId],
+                 alpha: np.ndarray,
+                 beta: np.ndarray,
+                 chunk_size: ChunkSize):
+        """
+        Initialize the compiled topology.
+
+        :param node_list: NPU ids, in index order
+        :param edge_list: links (src, dest), in index order
+        :param alpha: latency of each link in ns
+        :param beta: bandwidth of each link in GB/s
+        :param chunk_size: chunk size used to compute the link delays
+        """
+        self.chunk_size = chunk_size
+        self.node_list = node_list
+        self.edge_list = edge_list
+        self.node_index: Dict[NpuId, int] = {node: i for i, node in enumerate(node_list)}
+        self.edge_index: Dict[LinkId, int] = {edge: i for i, edge in enumerate(edge_list)}
+
+        self.src = np.array([self.node_index[src] for src, _ in edge_list], dtype=np.int64)
+        self.dest = np.array([self.node_index[dest] for _, dest in edge_list], dtype=np.int64)
+        self.alpha = np.asarray(alpha, dtype=np.float64)
+        self.beta = np.asarray(beta, dtype=np.float64)
+        self.delay = self.alpha + (chunk_size/(1 << 30))*(1e9/self.beta)
+
+        self.out_indptr, self.out_edges = self._csr(self.src)
+        self.in_indptr, self.in_edges = self._csr(self.dest)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_list)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edge_list)
+
+    def content_hash(self) -> str:
+        """
+        Hash of the node ids, links, alpha, beta, and chunk size, stable across processes.
+
+        :return: hex digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array(self.node_list, dtype=np.int64).tobytes())
+        digest.update(self.src.tobytes())
+        digest.update(self.dest.tobytes())
+        digest.update(self.alpha.tobytes())
+        digest.update(self.beta.tobytes())
+        digest.update(np.float64(self.chunk_size).tobytes())
+        return digest.hexdigest()
+
+    def _csr(self, endpoint: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        edges = np.argsort(endpoint, kind="stable")
+        indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(endpoint, minlength=self.num_nodes), out=indptr[1:])
+        return indptr, edges
+
+    def get_out_edges(self, node: int) -> np.ndarray:
+        """
+        :param node: node index
+        :return: indices of the links leaving the node
+        """
+        return self.out_edges[self.out_indptr[node]:self.out_indptr[node + 1]]
+
+    def get_in_edges(self, node: int) -> np.ndarray:
+        """
+        :param node: node index
+        :return: indices of the links entering the node
+        """
+        return self.in_edges[self.in_indptr[node]:self.in_indptr[node + 1]]
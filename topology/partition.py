@@ -0,0 +1,78 @@
+import networkx as nx
+from helper.typing import *
+from topology.topology import Topology
+
+
+def partition_topology(topology: Topology, max_cluster_size: int, seed: Optional[int] = None) -> List[List[NpuId]]:
+    """
+    Partition a topology into strongly connected clusters of at most max_cluster_size NPUs.
+
+    A cluster that is too large is split along its slowest links if removing them leaves balanced pieces
+    (e.g., the scale-out links between scale-up domains); otherwise it is bisected with Kernighan-Lin,
+    weighted by bandwidth so that the cut keeps as little bandwidth as possible. Kernighan-Lin starts from
+    the half of the NPUs closest to a peripheral NPU, which keeps both halves compact.
+
+    :param topology: topology to partition
+    :param max_cluster_size: largest allowed number of NPUs per cluster
+    :param seed: seed of the Kernighan-Lin bisection
+    :return: clusters, each a list of NPU ids
+    """
+    if max_cluster_size < 1:
+        raise ValueError(f"Cluster size must be positive but got {max_cluster_size}")
+    undirected = nx.Graph()
+    undirected.add_nodes_from(topology.G.nodes)
+    for src, dest, beta in topology.G.edges(data="beta"):
+        # a pair of opposite links counts with the bandwidth of the faster one
+        if not undirected.has_edge(src, dest) or undirected.edges[src, dest]["beta"] < beta:
+            undirected.add_edge(src, dest, beta=beta)
+
+    clusters = []
+    pending = [set(undirected.nodes)]
+    while pending:
+        nodes = pending.pop()
+        subgraph = undirected.subgraph(nodes)
+        components = list(nx.connected_components(subgraph))
+        if len(components) > 1:
+            pending.extend(components)
+        elif len(nodes) <= max_cluster_size:
+            clusters.append(nodes)
+        else:
+            pending.extend(_split_slowest_links(subgraph) or nx.community.kernighan_lin_bisection(subgraph, partition=_bfs_bisection(subgraph), weight="beta", seed=seed))
+
+    # intra-cluster synthesis needs every NPU of a cluster to reach every other one
+    strongly_connected = []
+    for nodes in clusters:
+        strongly_connected.extend(nx.strongly_connected_components(topology.G.subgraph(nodes)))
+    return sorted(sorted(cluster) for cluster in strongly_connected)
+
+
+def _split_slowest_links(subgraph: nx.Graph) -> Optional[List[Set[NpuId]]]:
+    """
+    :param subgraph: connected graph
+    :return: connected components once the slowest links are removed, or None if they are not balanced
+    """
+    betas = [beta for _, _, beta in subgraph.edges(data="beta")]
+    slowest = min(betas, default=None)
+    if slowest is None or slowest == max(betas):
+        return None
+    components = list(nx.connected_components(subgraph.edge_subgraph((src, dest) for src, dest, beta in subgraph.edges(data="beta") if beta > slowest)))
+    # nodes whose links are all slow are single-node components
+    covered = set().union(*components)
+    components.extend({node} for node in subgraph.nodes if node not in covered)
+    sizes = [len(component) for component in components]
+    if len(components) < 2 or 2*min(sizes) < max(sizes):
+        return None
+    return components
+
+
+def _bfs_bisection(subgraph: nx.Graph) -> Tuple[Set[NpuId], Set[NpuId]]:
+    """
+    :param subgraph: connected graph
+    :return: the half of the nodes nearest to a pseudo-peripheral node, and the other half
+    """
+    # the last node of a BFS order is far from its start, and two sweeps find a node near the periphery
+    start = min(subgraph.nodes)
+    for _ in range(2):
+        start = list(nx.bfs_tree(subgraph, start))[-1]
+    order = list(nx.bfs_tree(subgraph, start))
+    return set(order[:len(order)//2]), set(order[len(order)//2:])
@@ -0,0 +1,95 @@
+import os
+import heapq
+import tempfile
+import numpy as np
+from helper.typing import *
+from helper.cache_dir import get_cache_dir
+from topology.compiled_topology import CompiledTopology
+
+SHORTEST_PATHS_CACHE_DIR = get_cache_dir("shortest_paths")
+
+# in-process cache, keyed by CompiledTopology.content_hash()
+_shortest_paths_cache: Dict[str, np.ndarray] = {}
+
+
+def get_shortest_paths(compiled: CompiledTopology, cache_dir: Optional[str] = SHORTEST_PATHS_CACHE_DIR) -> np.ndarray:
+    """
+    All-pairs shortest-path delays of a compiled topology, indexed [src, dest] by node index.
+    Results are cached in memory and, unless cache_dir is None, as <content hash>.npy files in cache_dir.
+
+    :param compiled: compiled topology (its chunk size determines the link delays)
+    :param cache_dir: directory of the on-disk cache
+    :return: (nodes x nodes) shortest-path delays, inf where unreachable
+    """
+    key = compiled.content_hash()
+    if key in _shortest_paths_cache:
+        return _shortest_paths_cache[key]
+    filename = os.path.join(cache_dir, f"{key}.npy") if cache_dir is not None else None
+    if filename is not None and os.path.exists(filename):
+        shortest_paths = np.load(filename)
+    else:
+        shortest_paths = compute_shortest_paths(compiled)
+        if filename is not None:
+            # write to a temporary file first so concurrent readers never see a partial file
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".npy", delete=False) as f:
+                np.save(f, shortest_paths)
+            os.replace(f.name, filename)
+    shortest_paths.flags.writeable = False
+    _shortest_paths_cache[key] = shortest_paths
+    return shortest_paths
+
+
+def compute_shortest_paths(compiled: CompiledTopology) -> np.ndarray:
+    """
+    BFS from every node if all links have the same delay, otherwise Dijkstra from every node, over the CSR adjacency.
+
+    :param compiled: compiled topology
+    :return: (nodes x nodes) shortest-path delays, inf where unreachable
+    """
+    out_indptr = compiled.out_indptr.tolist()
+    out_edges = compiled.out_edges.tolist()
+    dest = compiled.dest.tolist()
+    delay = compiled.delay.tolist()
+    homogeneous = compiled.num_edges > 0 and bool(np.all(compiled.delay == compiled.delay[0]))
+
+    shortest_paths = np.full((compiled.num_nodes, compiled.num_nodes), np.inf)
+    for source in range(compiled.num_nodes):
+        if homogeneous:
+            hops = _bfs(source, out_indptr, out_edges, dest)
+            reached = hops >= 0
+            shortest_paths[source, reached] = hops[reached]*compiled.delay[0]
+        else:
+            shortest_paths[source] = _dijkstra(source, out_indptr, out_edges, dest, delay)
+    return shortest_paths
+
+
+def _bfs(source: int, out_indptr: List[int], out_edges: List[int], dest: List[int]) -> np.ndarray:
+    hops = [-1]*(len(out_indptr)-1)
+    hops[source] = 0
+    frontier = [source]
+    while len(frontier) > 0:
+        next_frontier = []
+        for node in frontier:
+            for edge in out_edges[out_indptr[node]:out_indptr[node+1]]:
+                if hops[dest[edge]] < 0:
+                    hops[dest[edge]] = hops[node]+1
+                    next_frontier.append(dest[edge])
+        frontier = next_frontier
+    return np.array(hops)
+
+
+def _dijkstra(source: int, out_indptr: List[int], out_edges: List[int], dest: List[int], delay: List[float]) -> np.ndarray:
+    distance = [np.inf]*(len(out_indptr)-1)
+    distance[source] = 0.
+    heap = [(0., source)]
+    while len(heap) > 0:
+        node_distance, node = heapq.heappop(heap)
+        if node_distance > distance[node]:
+            continue
+        for edge in out_edges[out_indptr[node]:out_indptr[node+1]]:
+            candidate = node_distance+delay[edge]
+            if candidate < distance[dest[edge]]:
+                distance[dest[edge]] = candidate
+                heapq.heappush(heap, (candidate, dest[edge]))
+    return np.array(distance)
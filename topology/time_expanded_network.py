@@ -0,0 +1,90 @@
+import csv
+import numpy as np
+from helper.typing import *
+from topology.compiled_topology import CompiledTopology
+
+
+class TimeExpandedNetwork:
+    """
+    Time-expanded network (TEN) of a compiled topology.
+
+    Link delays are rounded up to whole timesteps, so a schedule that respects the rounded delays
+    is also valid with the continuous ones. The TEN itself is implicit: the TEN link that starts
+    at timestep t on link e has id t*num_edges+e and finishes at t+link_steps[e].
+    """
+
+    def __init__(self,
+                 compiled: CompiledTopology,
+                 timestep: Optional[Time] = None):
+        """
+        Discretize the compiled topology.
+
+        :param compiled: compiled topology
+        :param timestep: duration of a timestep in ns (default: the smallest link delay)
+        """
+        self.compiled = compiled
+        self.timestep: Time = float(timestep if timestep is not None else (np.min(compiled.delay) if compiled.num_edges>0 else 1.))
+        if self.timestep <= 0:
+            raise ValueError(f"Timestep must be positive but got {self.timestep}")
+        # tolerance keeps delays that are whole multiples of the timestep from rounding up an extra step
+        self.link_steps = np.maximum(np.ceil(compiled.delay/self.timestep - 1e-9), 1).astype(np.int64)
+
+    @property
+    def num_edges(self) -> int:
+        return self.compiled.num_edges
+
+    def to_time(self, step: TenTimestep) -> Time:
+        return step*self.timestep
+
+    def to_step(self, time: Time) -> TenTimestep:
+        return int(round(time/self.timestep))
+
+    def get_ten_link_id(self, start: TenTimestep, edge: int) -> TenLinkId:
+        """
+        :param start: start timestep
+        :param edge: link index
+        :return: id of the TEN link
+        """
+        return start*self.num_edges + edge
+
+    def get_ten_link(self, ten_link: TenLinkId) -> TenLinkDataFull:
+        """
+        :param ten_link: id of the TEN link
+        :return: (start timestep, finish timestep, src, dest)
+        """
+        start, edge = divmod(ten_link, self.num_edges)
+        src, dest = self.compiled.edge_list[edge]
+        return start, start + int(self.link_steps[edge]), src, dest
+
+    def get_ten_links(self, horizon: TenTimestep) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param horizon: last timestep
+        :return: (TEN link ids, start timesteps, link indices) of every TEN link that finishes by horizon
+        """
+        starts = np.arange(horizon + 1, dtype=np.int64)[:, None]
+        mask = starts + self.link_steps[None, :] <= horizon
+        start, edge = np.nonzero(mask)
+        return start*self.num_edges + edge, start, edge
+
+    def write_ten(self, filename: str, events: List[Event]) -> None:
+        """
+        Write a schedule as the TEN links it occupies. Events must finish on a timestep boundary.
+
+        :param filename: output csv
+        :param events: (link, chunk, send time, receive time) events of the schedule
+        """
+        rows = []
+        for edge, chunk, _, receive_time in events:
+            edge_index = self.compiled.edge_index[edge]
+            finish = self.to_step(receive_time)
+            start = finish - int(self.link_steps[edge_index])
+            rows.append((self.get_ten_link_id(start, edge_index), start, finish, edge[0], edge[1], chunk))
+        rows.sort()
+        with open(filename, mode="w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["NPUs Count",self.compiled.num_nodes])
+            writer.writerow(["Links Count",self.num_edges])
+            writer.writerow(["Timestep",self.timestep,"ns"])
+            writer.writerow(["Timesteps Count",max((row[2] for row in rows), default=0)])
+            writer.writerow(["TenLinkID","Start Timestep","Finish Timestep","SrcID","DestID","ChunkID"])
+            writer.writerows(rows)
@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd
 import networkx as nx
 from helper.typing import *
+from topology.compiled_topology import CompiledTopology
 
 class Topology:
     """
@@ -23,6 +24,8 @@ class Topology:
         elif num_nodes is not None and G is None and filename is None:
             self.G = nx.DiGraph()
             self.G.add_nodes_from(range(num_nodes))
+            self.compiled = {}
+            self.automorphisms = []
         else:
             raise ValueError("Exactly one of 'npus_count', 'G', or 'filename' must be specified")
 
@@ -37,6 +40,25 @@ class Topology:
     def get_delay(self, edge: LinkId, chunk_size: ChunkSize = UnitChunkSize) -> Time:
         return self.G.edges[edge]["alpha"]+ (chunk_size/(1 << 30))*(1e9/self.G.edges[edge]["beta"])
 
+    def compile(self, chunk_size: ChunkSize = UnitChunkSize) -> CompiledTopology:
+        """
+        Build (or fetch the cached) edge-indexed arrays of the topology for a chunk size.
+        The cache is cleared by connect() and load_nx(); edit self.G directly only before compiling.
+
+        :param chunk_size: chunk size used to compute the link delays
+        :return: compiled topology
+        """
+        if chunk_size not in self.compiled:
+            edge_list = list(self.G.edges)
+            self.compiled[chunk_size] = CompiledTopology(
+                node_list=list(self.G.nodes),
+                edge_list=edge_list,
+                alpha=[self.G.edges[edge]["alpha"] for edge in edge_list],
+                beta=[self.G.edges[edge]["beta"] for edge in edge_list],
+                chunk_size=chunk_size,
+            )
+        return self.compiled[chunk_size]
+
     def connect(self,
                 src: NpuId,
                 dest: NpuId,
@@ -50,11 +72,17 @@ class Topology:
         :return: None
         """
         self.G.add_edge(src,dest,alpha=link_alpha_beta[0],beta=link_alpha_beta[1])
+        self.compiled = {}
+        self.automorphisms = []
     
     def load_nx(self, G: nx.Graph) -> None:
         if len(nx.get_edge_attributes(G,"alpha"))==0 or len(nx.get_edge_attributes(G,"beta"))==0:
             raise ValueError("Graph must have 'alpha' (latency in ns) and 'beta' (bandwidth in GB/s) edge attributes")
         self.G = G
+        self.compiled: Dict[ChunkSize, CompiledTopology] = {}
+        # generators of a group of automorphisms that maps every NPU to every other NPU in exactly one way
+        # (e.g., the translations of a torus), set by topology generators that know them
+        self.automorphisms: List[Dict[NpuId, NpuId]] = []
 
     def load_file(self, filename: str) -> None:
         df = pd.read_csv(filename,skiprows=1)